@@ -0,0 +1,106 @@
+"""Benchmarks for snake_engine.
+
+By default plays random games headless (turning at random, restarting on
+death) and reports steps per second.  --lengths runs a snake of each
+length forever along a cycle through every cell of a large grid, with
+SnakeEngine and with the tile-list move() from the original snake
+game.py, and reports the time per tick.
+
+    python benchmark.py --steps 2000000
+    python benchmark.py --lengths 10,1000,10000
+"""
+
+import argparse
+import random
+import time
+
+from snake_engine import DIED, DOWN, LEFT, RIGHT, UP, SnakeEngine
+
+
+class Tile:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def legacy_move(snake, snake_body, velocity):
+    """move() from the original snake game.py, in grid units; returns False on death."""
+    for segment in snake_body:
+        if snake.x == segment.x and snake.y == segment.y:
+            return False
+    if snake_body:
+        for i in range(len(snake_body) - 1, 0, -1):
+            snake_body[i].x = snake_body[i - 1].x
+            snake_body[i].y = snake_body[i - 1].y
+        snake_body[0].x = snake.x
+        snake_body[0].y = snake.y
+    snake.x += velocity[0]
+    snake.y += velocity[1]
+    return True
+
+
+def hamiltonian_cycle(rows, cols):
+    """Cells (x, y) of a cycle through the whole grid: along the rows, back up column 0."""
+    order = []
+    for y in range(rows):
+        xs = range(1, cols) if y % 2 == 0 else range(cols - 1, 0, -1)
+        order.extend((x, y) for x in xs)
+    order.extend((0, y) for y in range(rows - 1, -1, -1))
+    return order
+
+
+def random_games(steps, seed=1):
+    engine = SnakeEngine(seed=seed)
+    rng = random.Random(seed)
+    directions = (UP, DOWN, LEFT, RIGHT)
+    turns = [rng.choice(directions) if rng.random() < 0.2 else None for _ in range(4096)]
+    games = 0
+    engine.turn(RIGHT)
+    start = time.perf_counter()
+    for i in range(steps):
+        if engine.step(turns[i & 4095]) == DIED:
+            games += 1
+            engine.reset()
+            engine.turn(RIGHT)
+    elapsed = time.perf_counter() - start
+    print(f"{steps:,} steps over {games:,} games in {elapsed:.2f} s ({steps / elapsed:,.0f} steps/s)")
+
+
+def long_snake(length, steps, size=200):
+    order = hamiltonian_cycle(size, size)
+    moves = {}
+    for (x, y), (nx, ny) in zip(order, order[1:] + order[:1]):
+        moves[(x, y)] = (nx - x, ny - y)
+    body = [order[-i] for i in range(length)]  # head at order[0], the rest behind it along the cycle
+
+    # The food starts just behind the tail, a whole lap away, so the snake grows by a cell or two at most.
+    engine = SnakeEngine(size, size, seed=1, body=body, food=order[-length])
+    start = time.perf_counter()
+    for _ in range(steps):
+        engine.step(moves[(engine.head_x, engine.head_y)])
+    new = (time.perf_counter() - start) / steps
+
+    snake = Tile(*body[0])
+    snake_body = [Tile(x, y) for x, y in body[1:]]
+    legacy_steps = max(1, min(steps, 20_000_000 // length))
+    start = time.perf_counter()
+    for _ in range(legacy_steps):
+        legacy_move(snake, snake_body, moves[(snake.x, snake.y)])
+    old = (time.perf_counter() - start) / legacy_steps
+    print(f"length {length:>7,}: engine {new * 1e6:8.2f} us/tick   legacy move() {old * 1e6:10.2f} us/tick")
+
+
+def main():
+    p = argparse.ArgumentParser(description="snake engine benchmarks")
+    p.add_argument("--steps", type=int, default=2_000_000, help="steps to simulate (default: 2000000)")
+    p.add_argument("--lengths", help="comma-separated snake lengths to time per tick")
+    args = p.parse_args()
+    if args.lengths:
+        for length in map(int, args.lengths.split(",")):
+            long_snake(length, min(args.steps, 200_000))
+        return
+    random_games(args.steps)
+
+
+if __name__ == "__main__":
+    main()
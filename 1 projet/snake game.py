@@ -1,137 +1,103 @@
+import time
 import tkinter
-import random
+from collections import deque
+
+from snake_engine import ATE, COLS, DOWN, LEFT, MOVED, RIGHT, ROWS, UP, SnakeEngine
 
-ROWS = 20
-COLS = 20
 TILE_SIZE = 20
+# The game advances in fixed steps of TICK seconds; a late frame catches up by up to MAX_CATCH_UP steps.
+TICK = 0.1
+MAX_CATCH_UP = 5
 
 WINDOW_WIDTH = COLS * TILE_SIZE
 WINDOW_HEIGHT = ROWS * TILE_SIZE
 
-class tile:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-    #     self.color = "white"
-    
-    # def draw(self):
-    #     x1 = self.x * TILE_SIZE
-    #     y1 = self.y * TILE_SIZE
-    #     x2 = x1 + TILE_SIZE
-    #     y2 = y1 + TILE_SIZE
-    #     canvas.create_rectangle(x1, y1, x2, y2, fill=self.color, outline="")
-
-#game window
-
-window = tkinter.Tk()
-window.title("Snake Game")
-window.resizable(False, False)
-canvas = tkinter.Canvas(window,bg="black", width=WINDOW_WIDTH, height=WINDOW_HEIGHT,borderwidth=0, highlightthickness=0)
-
-canvas.pack()
-window.update()
-
-#window center
-window_width = window.winfo_width()
-window_height = window.winfo_height()
-Screen_width = window.winfo_screenwidth()
-Screen_height = window.winfo_screenheight()
-
-window_x = int((Screen_width/2) - (window_width/2))
-window_y = int((Screen_height/2) - (window_height/2))
-
-window.geometry(f"{window_width}x{window_height}+{window_x}+{window_y}")
-
-#initialize game
-
-snake = tile(5*TILE_SIZE, 5*TILE_SIZE)
-food = tile(10*TILE_SIZE, 10*TILE_SIZE)
-snake_body = []
-velocity_x = 0
-velocity_y = 0
-game_over = False
-score = 0
-
-def change_direction(e):
-#   print(e.keysym)  
-    global velocity_x, velocity_y, game_over
-    if game_over:
-        return
-    
-    if (e.keysym == "Up" and velocity_y != 1):
-         velocity_x = 0
-         
-         velocity_y = -1
-    elif (e.keysym == "Down" and velocity_y != -1):
-        velocity_x = 0
-        velocity_y = 1
-    elif (e.keysym == "Right"and velocity_x != -1):
-        velocity_x = 1
-        velocity_y = 0
-    elif (e.keysym == "Left" and velocity_x != 1):
-        velocity_x = -1
-        velocity_y = 0
-    
-
-def move():
-    global snake,food,snake_body,game_over,score
-    if game_over:
-        return
-    
-    if (snake.x < 0 or snake.x >= WINDOW_WIDTH or snake.y < 0 or snake.y >= WINDOW_HEIGHT):
-        game_over = True
-        return
-    
-    for segment in snake_body:
-        if (snake.x == segment.x and snake.y == segment.y):
-            game_over = True
+KEYS = {"Up": UP, "Down": DOWN, "Left": LEFT, "Right": RIGHT}
+
+
+class SnakeRenderer:
+    """Draws a SnakeEngine on a canvas and feeds it the arrow keys.
+
+    Each step only adds a rectangle for the new head and deletes the one
+    for the old tail, so drawing costs the same whatever the snake's length.
+    """
+
+    def __init__(self, window, engine):
+        self.window = window
+        self.engine = engine
+        self.canvas = tkinter.Canvas(window, bg="black", width=WINDOW_WIDTH, height=WINDOW_HEIGHT,
+                                     borderwidth=0, highlightthickness=0)
+        self.canvas.pack()
+
+        self.food = self.canvas.create_rectangle(*self.box(engine.food), fill="red")
+        self.segments = deque(self.canvas.create_rectangle(*self.box(cell), fill="green") for cell in engine.body)
+        self.score = self.canvas.create_text(30, 20, font="Arial 14", text="Score: 0", fill="white")
+        self.shown_game_over = False
+
+        window.bind("<KeyPress>", self.change_direction)
+        self.last = time.perf_counter()
+        self.lag = 0.0
+        self.tick()
+
+    def box(self, cell):
+        x, y = self.engine.position(cell)
+        return x * TILE_SIZE, y * TILE_SIZE, (x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE
+
+    def change_direction(self, e):
+        if e.keysym in KEYS and not self.engine.over:
+            self.engine.turn(KEYS[e.keysym])
+
+    def tick(self):
+        now = time.perf_counter()
+        self.lag = min(self.lag + now - self.last, MAX_CATCH_UP * TICK)
+        self.last = now
+        while self.lag >= TICK:
+            self.lag -= TICK
+            self.draw_step(self.engine.step())
+        if self.engine.over:
+            self.game_over()
+            return
+        self.window.after(max(1, int((TICK - self.lag) * 1000)), self.tick)
+
+    def draw_step(self, result):
+        if result == MOVED:
+            # Reuse the tail's rectangle as the new head.
+            tail = self.segments.pop()
+            self.canvas.coords(tail, *self.box(self.engine.body[0]))
+            self.segments.appendleft(tail)
+        elif result == ATE:
+            self.segments.appendleft(self.canvas.create_rectangle(*self.box(self.engine.body[0]), fill="green"))
+            if self.engine.food is not None:
+                self.canvas.coords(self.food, *self.box(self.engine.food))
+            self.canvas.itemconfig(self.score, text=f"Score: {self.engine.score}")
+
+    def game_over(self):
+        if self.shown_game_over:
             return
+        self.shown_game_over = True
+        self.canvas.delete(self.score)
+        text = "YOU WIN" if self.engine.won else "GAME OVER"
+        self.canvas.create_text(WINDOW_WIDTH/2, WINDOW_HEIGHT/2, font="Arial 20",
+                                text=f"{text} :{self.engine.score}", fill="white")
+
+
+if __name__ == "__main__":
+    #game window
+
+    window = tkinter.Tk()
+    window.title("Snake Game")
+    window.resizable(False, False)
+    game = SnakeRenderer(window, SnakeEngine(food=(10, 10)))
+    window.update()
+
+    #window center
+    window_width = window.winfo_width()
+    window_height = window.winfo_height()
+    Screen_width = window.winfo_screenwidth()
+    Screen_height = window.winfo_screenheight()
+
+    window_x = int((Screen_width/2) - (window_width/2))
+    window_y = int((Screen_height/2) - (window_height/2))
 
-    # update body positions (from tail to head)
-    if snake_body:
-        for i in range(len(snake_body) - 1, 0, -1):
-            snake_body[i].x = snake_body[i - 1].x
-            snake_body[i].y = snake_body[i - 1].y
-        snake_body[0].x = snake.x
-        snake_body[0].y = snake.y
-
-    # collision with food
-    if snake.x == food.x and snake.y == food.y:
-        # grow snake: add new tile at the last position
-        if snake_body:
-            last = snake_body[-1]
-            snake_body.append(tile(last.x, last.y))
-        else:
-            snake_body.append(tile(snake.x, snake.y))
-        food.x = random.randint(0, COLS - 1) * TILE_SIZE
-        food.y = random.randint(0, ROWS - 1) * TILE_SIZE
-        score += 1
-
-    snake.x += velocity_x * TILE_SIZE
-    snake.y += velocity_y * TILE_SIZE
-
-
-
-def draw():
-    global snake, food, game_over,score
-    move()
-    canvas.delete("all")
-
-    # food.draw()
-    canvas.create_rectangle(food.x, food.y, food.x + TILE_SIZE, food.y + TILE_SIZE, fill="red")
-    
-    # snake.draw()
-    canvas.create_rectangle(snake.x, snake.y, snake.x + TILE_SIZE, snake.y + TILE_SIZE, fill="green")
-    window.after(100, draw)
-    for segment in snake_body:
-        canvas.create_rectangle(segment.x, segment.y, segment.x + TILE_SIZE, segment.y + TILE_SIZE, fill="green")
-
-    if(game_over):
-        canvas.create_text(WINDOW_WIDTH/2, WINDOW_HEIGHT/2, font="Arial 20",text=f"GAME OVER :{score}", fill="white")
-    else:
-        canvas.create_text(30,20, font="Arial 14",text=f"Score: {score}", fill="white")
-
-
-draw()
-window.bind("<KeyPress>", change_direction)
-window.mainloop()
\ No newline at end of file
+    window.geometry(f"{window_width}x{window_height}+{window_x}+{window_y}")
+    window.mainloop()
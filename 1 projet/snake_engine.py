@@ -0,0 +1,139 @@
+"""Snake game rules with no UI, one step per tick.
+
+Cells are numbered row * cols + col.  The snake is a deque of cells, head
+first.  A free-cell array `free`, with `slot` giving each cell's position
+in it (-1 for cells the snake is on), doubles as the occupancy map.  A
+step therefore costs the same whatever the snake's length: a collision is
+one lookup, moving is one push and one pop, and new food is one random
+pick from `free`.  Every random choice comes from one seedable
+random.Random, so a game can be replayed exactly from its seed and
+moves.
+
+    engine = SnakeEngine(seed=1)
+    while engine.step(RIGHT) != DIED:
+        ...
+"""
+
+import random
+from collections import deque
+
+ROWS = 20
+COLS = 20
+
+UP = (0, -1)
+DOWN = (0, 1)
+LEFT = (-1, 0)
+RIGHT = (1, 0)
+STOP = (0, 0)
+
+# What a step did.
+IDLE, MOVED, ATE, DIED = "idle", "moved", "ate", "died"
+
+
+class SnakeEngine:
+    def __init__(self, rows=ROWS, cols=COLS, seed=None, body=((5, 5),), food=None):
+        self.rows = rows
+        self.cols = cols
+        self.rng = random.Random(seed)
+        self.reset(body, food)
+
+    def reset(self, body=((5, 5),), food=None):
+        """Start a new game with the snake on body, (x, y) cells head first, standing still.
+
+        food is placed at random when not given.
+        """
+        cells = self.rows * self.cols
+        self.free = list(range(cells))
+        self.slot = list(range(cells))
+        self.body = deque()
+        for x, y in body:
+            cell = self._cell(x, y)
+            if self.slot[cell] < 0:
+                raise ValueError(f"The snake crosses itself at {(x, y)}")
+            self._take(cell)
+            self.body.append(cell)
+        if not self.body:
+            raise ValueError("The snake needs at least one cell")
+        self.head_x, self.head_y = body[0]
+        # The direction of the last move, and the one the next step takes.
+        self.heading = self.direction = STOP
+        self.score = 0
+        self.over = self.won = False
+        self.food = None
+        if food is not None:
+            self.food = self._cell(*food)
+            if self.slot[self.food] < 0:
+                raise ValueError(f"The food is on the snake at {food}")
+        else:
+            self._place_food()
+
+    def _cell(self, x, y):
+        if not (0 <= x < self.cols and 0 <= y < self.rows):
+            raise ValueError(f"{(x, y)} is outside the {self.cols}x{self.rows} grid")
+        return y * self.cols + x
+
+    def _take(self, cell):
+        # Swap the cell with the last free one and drop it from the end.
+        i = self.slot[cell]
+        last = self.free.pop()
+        if last != cell:
+            self.free[i] = last
+            self.slot[last] = i
+        self.slot[cell] = -1
+
+    def _release(self, cell):
+        self.slot[cell] = len(self.free)
+        self.free.append(cell)
+
+    def _place_food(self):
+        if self.free:
+            self.food = self.free[self.rng.randrange(len(self.free))]
+        else:
+            self.food = None
+            self.over = self.won = True
+
+    def turn(self, direction):
+        """Steer for the next step; turning back onto the snake's own neck is ignored."""
+        dx, dy = direction
+        if len(self.body) > 1 and (dx, dy) == (-self.heading[0], -self.heading[1]):
+            return
+        self.direction = direction
+
+    def step(self, direction=None):
+        """Advance one tick, turning first if direction is given; returns IDLE, MOVED, ATE or DIED."""
+        if direction is not None and direction != self.direction:
+            self.turn(direction)
+        if self.over:
+            return DIED
+        dx, dy = self.direction
+        if not (dx or dy):
+            return IDLE
+        x, y = self.head_x + dx, self.head_y + dy
+        if not (0 <= x < self.cols and 0 <= y < self.rows):
+            self.over = True
+            return DIED
+        cell = y * self.cols + x
+        ate = cell == self.food
+        # The tail moves out of the way in the same tick, unless the snake is growing.
+        if self.slot[cell] < 0 and (ate or cell != self.body[-1]):
+            self.over = True
+            return DIED
+        if not ate:
+            self._release(self.body.pop())
+        self._take(cell)
+        self.body.appendleft(cell)
+        self.head_x, self.head_y = x, y
+        self.heading = self.direction
+        if not ate:
+            return MOVED
+        self.score += 1
+        self._place_food()
+        return ATE
+
+    def position(self, cell):
+        """(x, y) of a cell number."""
+        y, x = divmod(cell, self.cols)
+        return x, y
+
+    def occupied(self, x, y):
+        return self.slot[y * self.cols + x] < 0
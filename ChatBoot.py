@@ -1,55 +1,84 @@
+import argparse
+import itertools
+import logging
+import queue
+import time
 import tkinter as tk
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
 from tkinter import scrolledtext, messagebox
-import random
-import datetime
+from chatbot_engine import IntentEngine
+from chatbot_retrieval import DOCS_DIR, FaqIndex
+from chatbot_server import ChatClient
+
+# The window keeps the last TRANSCRIPT_LIMIT messages; the full conversation
+# goes to a log file rotated at TRANSCRIPT_LOG_BYTES, keeping TRANSCRIPT_LOG_BACKUPS old files.
+TRANSCRIPT_LIMIT = 500
+TRANSCRIPT_LOG = "chat_transcript.log"
+TRANSCRIPT_LOG_BYTES = 1024 * 1024
+TRANSCRIPT_LOG_BACKUPS = 5
+# Replies are worked out on RESPONSE_WORKERS threads and collected every POLL_MS.
+RESPONSE_WORKERS = 4
+POLL_MS = 20
+LATENCY_SAMPLES = 1000
+
+
+def transcript_logger(path=TRANSCRIPT_LOG):
+    logger = logging.getLogger("chatbot.transcript")
+    if not logger.handlers:
+        handler = RotatingFileHandler(path, maxBytes=TRANSCRIPT_LOG_BYTES,
+                                      backupCount=TRANSCRIPT_LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
 
 class ChatBotGUI:
-    def __init__(self, root):
+    def __init__(self, root, server=None, docs=DOCS_DIR):
         self.root = root
         self.root.title("Python Chat Bot")
         self.root.geometry("500x600")
         self.root.configure(bg='#f0f0f0')
         
         self.bot_name = "ChatBot"
-        self.setup_responses()
+        
+        # Messages are rendered in batches; the widget keeps the last TRANSCRIPT_LIMIT,
+        # with the line count of each shown message in _rendered_lines for trimming
+        self.log = transcript_logger()
+        self._pending = []
+        self._rendered_lines = deque()
+        self._flush_scheduled = False
+        
+        # Replies come back from worker threads through a queue; requests are kept in send order
+        self.replies = queue.Queue()
+        self._outstanding = {}
+        self._ready = {}
+        self._request_ids = itertools.count(1)
+        self._polling = False
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        
+        self.setup_responses(server, docs)
         self.create_widgets()
+        self.root.bind('<Escape>', lambda event: self.cancel_responses())
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
-    def setup_responses(self):
-        self.responses = {
-            "greeting": [
-                "Hello! How can I help you today?",
-                "Hi there! What's on your mind?",
-                "Hey! Nice to talk to you!"
-            ],
-            "how_are_you": [
-                "I'm doing great, thanks for asking!",
-                "I'm just a program, but I'm functioning perfectly!",
-                "All systems go! How are you?"
-            ],
-            "goodbye": [
-                "Goodbye! Have a great day!",
-                "See you later!",
-                "Bye! Come back anytime!"
-            ],
-            "help": [
-                "I can chat with you about simple topics. Try asking how I am or just say hello!",
-                "I'm a simple bot. You can greet me, ask how I am, or say goodbye!"
-            ],
-            "time": [
-                f"The current time is {datetime.datetime.now().strftime('%H:%M')}",
-                f"It's {datetime.datetime.now().strftime('%I:%M %p')} right now"
-            ],
-            "joke": [
-                "Why don't scientists trust atoms? Because they make up everything!",
-                "Why did the scarecrow win an award? He was outstanding in his field!",
-                "What do you call a fake noodle? An impasta!"
-            ],
-            "default": [
-                "That's interesting! Tell me more.",
-                "I see. What else would you like to talk about?",
-                "Interesting! Could you elaborate?"
-            ]
-        }
+    def setup_responses(self, server=None, docs=DOCS_DIR):
+        # With a server ("host:port") this window is just one client of chatbot_server.py.
+        if server:
+            try:
+                host, port = server.rsplit(":", 1)
+                self.engine = ChatClient(host, int(port))
+                # One connection answers in order, so a single worker uses it
+                self.executor = ThreadPoolExecutor(max_workers=1)
+                return
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Chat server", f"Could not connect to {server}: {e}\nChatting locally instead.")
+        # Questions no intent matches are looked up in the local documents before a default reply
+        faq = FaqIndex.open(docs)
+        self.engine = IntentEngine.from_file(faq=faq)
+        self.executor = ThreadPoolExecutor(max_workers=RESPONSE_WORKERS)
     
     def create_widgets(self):
         # Title
@@ -63,8 +92,15 @@ class ChatBotGUI:
                                                      font=('Arial', 11),
                                                      bg='white', fg='#333')
         self.chat_display.pack(padx=20, pady=10, fill=tk.BOTH, expand=True)
+        self.chat_display.tag_configure('bot_name', font=('Arial', 11, 'bold'), foreground='#4CAF50')
+        self.chat_display.tag_configure('user_name', font=('Arial', 11, 'bold'), foreground='#1976D2')
         self.chat_display.config(state=tk.DISABLED)
         
+        # Typing indicator and reply latency
+        self.status_label = tk.Label(self.root, text="", anchor='w',
+                                     font=('Arial', 9, 'italic'), bg='#f0f0f0', fg='#777')
+        self.status_label.pack(padx=20, fill=tk.X)
+        
         # Input frame
         input_frame = tk.Frame(self.root, bg='#f0f0f0')
         input_frame.pack(padx=20, pady=10, fill=tk.X)
@@ -93,66 +129,149 @@ class ChatBotGUI:
         self.add_message(self.bot_name, "Hello! I'm your Python chat bot. Type 'help' to see what I can do!")
     
     def get_bot_response(self, user_input):
-        user_input = user_input.lower()
-        
-        if any(word in user_input for word in ['hello', 'hi', 'hey']):
-            return random.choice(self.responses["greeting"])
-        
-        elif any(word in user_input for word in ['how are you', 'how do you do']):
-            return random.choice(self.responses["how_are_you"])
-        
-        elif any(word in user_input for word in ['bye', 'goodbye', 'see you']):
-            return random.choice(self.responses["goodbye"])
-        
-        elif any(word in user_input for word in ['help', 'what can you do']):
-            return random.choice(self.responses["help"])
-        
-        elif any(word in user_input for word in ['time', 'clock']):
-            return random.choice(self.responses["time"])
-        
-        elif any(word in user_input for word in ['joke', 'funny']):
-            return random.choice(self.responses["joke"])
+        return self.engine.respond(user_input)
+    
+    def add_message(self, sender, message, sent_at=None):
+        self.log.info("%s: %s", sender, message)
         
-        else:
-            return random.choice(self.responses["default"])
+        # Render once the event loop is idle, so a burst of messages costs one widget update
+        self._pending.append((sender, message, sent_at))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.root.after_idle(self._flush)
     
-    def add_message(self, sender, message):
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending[-TRANSCRIPT_LIMIT:], []
+        # Only follow new messages if the user has not scrolled up to read older ones
+        at_bottom = self.chat_display.yview()[1] >= 0.999
         self.chat_display.config(state=tk.NORMAL)
         
-        # Add sender tag
-        if sender == self.bot_name:
-            self.chat_display.insert(tk.END, f"{sender}: ", 'bot_name')
-        else:
-            self.chat_display.insert(tk.END, f"{sender}: ", 'user_name')
+        for sender, message, _ in pending:
+            tag = 'bot_name' if sender == self.bot_name else 'user_name'
+            self.chat_display.insert(tk.END, f"{sender}: ", tag)
+            self.chat_display.insert(tk.END, f"{message}\n\n")
+            self._rendered_lines.append(message.count("\n") + 2)
         
-        # Add message
-        self.chat_display.insert(tk.END, f"{message}\n\n")
+        # Trim the oldest messages so the widget never holds more than TRANSCRIPT_LIMIT
+        excess = len(self._rendered_lines) - TRANSCRIPT_LIMIT
+        if excess > 0:
+            lines = sum(self._rendered_lines.popleft() for _ in range(excess))
+            self.chat_display.delete("1.0", f"{lines + 1}.0")
         
         self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        if at_bottom:
+            self.chat_display.see(tk.END)
+        
+        # Input-to-render latency of every reply that just reached the screen
+        rendered_at = time.perf_counter()
+        for _, _, sent_at in pending:
+            if sent_at is not None:
+                self.latencies.append((rendered_at - sent_at) * 1000)
+        self.update_status()
+    
+    def latency_percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """Input-to-render latency in ms of recent replies, keyed by quantile."""
+        samples = sorted(self.latencies)
+        if not samples:
+            return {}
+        return {q: samples[min(int(len(samples) * q), len(samples) - 1)] for q in quantiles}
+    
+    def update_status(self):
+        if self._outstanding:
+            text = f"{self.bot_name} is typing... (Esc to cancel)"
+        else:
+            text = "  ".join(f"p{q * 100:g} {ms:.0f} ms" for q, ms in self.latency_percentiles().items())
+            text = f"Reply latency {text}" if text else ""
+        self.status_label.config(text=text)
     
     def send_message(self):
         user_message = self.message_entry.get().strip()
         
         if user_message:
+            sent_at = time.perf_counter()
+            
             # Add user message
             self.add_message("You", user_message)
             
             # Clear input
             self.message_entry.delete(0, tk.END)
             
-            # Get and add bot response
-            bot_response = self.get_bot_response(user_message)
-            self.add_message(self.bot_name, bot_response)
+            # Get the bot response on a worker thread; _poll adds it when it is ready
+            request_id = next(self._request_ids)
+            future = self.executor.submit(self._respond, request_id, user_message)
+            self._outstanding[request_id] = (future, sent_at)
+            self.update_status()
+            if not self._polling:
+                self._polling = True
+                self.root.after(POLL_MS, self._poll)
+    
+    def _respond(self, request_id, user_message):
+        # Runs on a worker thread: never touch Tk widgets here.  Every request must put
+        # a reply on the queue, or _poll would hold back all later replies waiting for it.
+        try:
+            reply = self.get_bot_response(user_message)
+        except Exception as e:
+            reply = f"Sorry, I could not get a reply: {e!r}"
+        self.replies.put((request_id, reply))
+    
+    def _poll(self):
+        while True:
+            try:
+                request_id, reply = self.replies.get_nowait()
+            except queue.Empty:
+                break
+            if request_id in self._outstanding:  # cancelled requests are dropped
+                self._ready[request_id] = reply
+        
+        # Show replies in the order the messages were sent
+        while self._outstanding:
+            request_id = next(iter(self._outstanding))
+            if request_id not in self._ready:
+                break
+            _, sent_at = self._outstanding.pop(request_id)
+            self.add_message(self.bot_name, self._ready.pop(request_id), sent_at)
+        
+        self.update_status()
+        if self._outstanding:
+            self.root.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+    
+    def cancel_responses(self):
+        # Queued requests never run; replies already being worked out are ignored
+        for future, _ in self._outstanding.values():
+            future.cancel()
+        self._outstanding.clear()
+        self._ready.clear()
+        self.update_status()
+    
+    def close(self):
+        self.cancel_responses()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        percentiles = self.latency_percentiles()
+        if percentiles:
+            self.log.info("-- reply latency %s --", ", ".join(f"p{q * 100:g} {ms:.1f} ms" for q, ms in percentiles.items()))
+        if isinstance(self.engine, ChatClient):
+            self.engine.close()
+        self.root.destroy()
     
     def clear_chat(self):
+        self.cancel_responses()
         self.chat_display.config(state=tk.NORMAL)
         self.chat_display.delete(1.0, tk.END)
         self.chat_display.config(state=tk.DISABLED)
+        self._pending.clear()
+        self._rendered_lines.clear()
+        self.log.info("-- chat cleared --")
         self.add_message(self.bot_name, "Chat cleared! How can I help you?")
 
 # Run the application
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Python Chat Bot")
+    parser.add_argument("--server", metavar="HOST:PORT", help="chat through a running chatbot_server.py")
+    parser.add_argument("--docs", default=DOCS_DIR, help="documents to answer questions from")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = ChatBotGUI(root)
+    app = ChatBotGUI(root, args.server, args.docs)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""Benchmarks for password_manager.
+
+By default compares the per-call functions (every call unlocks the vault and
+derives the key again) with a single unlocked Vault session.  --search times
+search over a synthetic vault, and --suite reports latency percentiles for
+every CLI operation over synthetic vaults of several sizes, for catching
+regressions (add --json for machine-readable lines).
+
+    python benchmark.py --ops 20
+    python benchmark.py --search 50000
+    python benchmark.py --suite --sizes 10,1000,100000 --json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import password_manager as pm
+
+MASTER = "benchmark-master-password"
+# The suite measures storage and crypto costs, so by default it builds vaults
+# with a token KDF; --real-kdf uses the production default instead.
+SUITE_KDF = {"name": "pbkdf2-sha256", "iterations": 1000}
+SUITE_OPS = ("init", "add", "get", "list", "delete", "change-master", "export", "import")
+
+
+def bench_per_call(path: str, ops: int) -> float:
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(ops):
+            if i % 2 == 0:
+                pm.add_entry(path, MASTER, f"site{i}", "user", "secret", "")
+            else:
+                pm.get_entry(path, MASTER, f"site{i - 1}")
+    return ops / (time.perf_counter() - start)
+
+
+def bench_session(path: str, ops: int) -> float:
+    start = time.perf_counter()
+    with pm.Vault.unlock(path, MASTER) as vault:
+        for i in range(ops):
+            if i % 2 == 0:
+                vault.set(f"site{i}", "user", "secret", "")
+                vault.save()
+            else:
+                vault.get(f"site{i - 1}")
+    return ops / (time.perf_counter() - start)
+
+
+SYLLABLES = ("ba", "ko", "ri", "tan", "mel", "sus", "dor", "vi", "ple", "gra", "nox", "qua", "zen", "fi",
+             "lo", "mar", "tek", "ul", "wy", "hex", "jo", "cru", "sta", "pin")
+
+
+def synthetic_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def synthetic_entries(count: int, seed: int = 1):
+    """Yield (label, username, notes) tuples that look roughly like a real vault."""
+    rng = random.Random(seed)
+    vocabulary = [synthetic_word(rng) for _ in range(5000)]
+    for i in range(count):
+        site = synthetic_word(rng)
+        yield (f"{site}.{rng.choice(('com', 'io', 'net', 'org'))}-{i}",
+               f"{synthetic_word(rng)}@{rng.choice(('example.com', 'corp.local'))}",
+               " ".join(rng.choice(vocabulary) for _ in range(rng.randint(0, 8))))
+
+
+def bench_search(path: str, count: int):
+    vault = pm.Vault.create(path, MASTER, ttl=None)
+    for label, username, notes in synthetic_entries(count):
+        vault.set(label, username, "secret", notes)
+    start = time.perf_counter()
+    vault.search("warm-up")
+    print(f"search index over {count} entries built in {time.perf_counter() - start:.2f} s")
+
+    label, username, notes = list(synthetic_entries(count))[count // 2]
+    queries = {
+        "exact": label,
+        "prefix": label[:4],
+        "typo": label[:2] + label[3:label.index("-")],
+        "username": username.split("@")[0],
+        "notes word": (notes.split() or ["none"])[0],
+        "no match": "gmial",
+    }
+    for name, query in queries.items():
+        timings = []
+        for _ in range(200):
+            start = time.perf_counter()
+            results = vault.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{name:>10} {query!r:>18}: p50 {statistics.median(timings):.3f} ms  "
+              f"p99 {timings[int(len(timings) * 0.99) - 1]:.3f} ms  top: {results[0][0] if results else '-'}")
+    vault.lock()
+
+
+def build_vault(path: str, count: int, kdf: dict):
+    vault = pm.Vault.create(path, MASTER, ttl=None, kdf=kdf)
+    for label, username, notes in synthetic_entries(count):
+        vault.set(label, username, "secret", notes)
+    vault.save()
+    vault.lock()
+
+
+def percentiles(timings: list) -> dict:
+    timings = sorted(timings)
+    pick = lambda q: timings[min(int(len(timings) * q), len(timings) - 1)]
+    return {"p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": timings[-1]}
+
+
+def bench_suite(tmp: str, sizes: list, repeat: int, kdf: dict, as_json: bool):
+    for size in sizes:
+        path = os.path.join(tmp, f"suite-{size}.json")
+        build_vault(path, size, kdf)
+        labels = [label for label, _, _ in synthetic_entries(size)]
+        rng = random.Random(size)
+        # Whole-vault operations get fewer rounds on big vaults.
+        heavy = max(1, min(repeat, 1_000_000 // max(size, 1) // 10))
+        ops = {
+            "init": (repeat, lambda i: build_vault(os.path.join(tmp, f"init-{size}-{i}.json"), 0, kdf)),
+            "add": (repeat, lambda i: pm.add_entry(path, MASTER, f"bench-{i}", "user", "secret", "")),
+            "get": (repeat, lambda i: pm.get_entry(path, MASTER, rng.choice(labels))),
+            "list": (heavy, lambda i: pm.list_entries(path, MASTER)),
+            "delete": (repeat, lambda i: pm.delete_entry(path, MASTER, f"bench-{i}")),
+            "change-master": (heavy, lambda i: pm.change_master(path, MASTER, MASTER)),
+            "export": (heavy, lambda i: pm.export_vault(path, MASTER, os.path.join(tmp, "export.json"))),
+            "import": (heavy, lambda i: pm.import_vault(os.path.join(tmp, "imported.json"), MASTER,
+                                                        os.path.join(tmp, "export.json"))),
+        }
+        for name in SUITE_OPS:
+            rounds, op = ops[name]
+            timings = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i in range(rounds):
+                    start = time.perf_counter()
+                    op(i)
+                    timings.append((time.perf_counter() - start) * 1000)
+            stats = percentiles(timings)
+            if as_json:
+                print(json.dumps({"entries": size, "op": name, "rounds": rounds,
+                                  **{k: round(v, 3) for k, v in stats.items()}}))
+            else:
+                print(f"{size:>7} {name:>14}: p50 {stats['p50']:9.2f} ms  p90 {stats['p90']:9.2f} ms  "
+                      f"p99 {stats['p99']:9.2f} ms  ({rounds} rounds)")
+
+
+def main():
+    p = argparse.ArgumentParser(description="password_manager throughput benchmark")
+    p.add_argument("--ops", type=int, default=20, help="operations per run (default: 20)")
+    p.add_argument("--search", type=int, metavar="N", help="time search over a synthetic N-entry vault")
+    p.add_argument("--suite", action="store_true", help="latency percentiles per operation and vault size")
+    p.add_argument("--sizes", default="10,100,1000,10000,100000",
+                   help="comma-separated vault sizes for --suite (default: 10,100,1000,10000,100000)")
+    p.add_argument("--repeat", type=int, default=20, help="rounds per operation for --suite (default: 20)")
+    p.add_argument("--real-kdf", action="store_true", help="build --suite vaults with the default KDF")
+    p.add_argument("--json", action="store_true", help="print --suite results as JSON lines")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.suite:
+            sizes = [int(size) for size in args.sizes.split(",")]
+            bench_suite(tmp, sizes, args.repeat, pm.KDF_DEFAULT if args.real_kdf else SUITE_KDF, args.json)
+        if args.search:
+            bench_search(os.path.join(tmp, "search.json"), args.search)
+        if args.suite or args.search:
+            return
+        for name, bench in (("per-call", bench_per_call), ("session", bench_session)):
+            path = os.path.join(tmp, f"{name}.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                pm.init_vault(path, MASTER)
+            rate = bench(path, args.ops)
+            print(f"{name:>10}: {rate:10.1f} ops/s  ({args.ops} ops, half add, half get)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +1,934 @@
 
 
 import argparse
+import asyncio
 import base64
+import bisect
+import collections
+import contextlib
+import csv
 import getpass
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
 import json
+import math
+import mmap
 import os
+import re
+import shutil
+import socket
+import stat
+import struct
 import sys
-from typing import Dict, Any
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, BinaryIO, Container, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
 
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import constant_time
 from cryptography.hazmat.backends import default_backend
 import secrets
 
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # cryptography < 44
+    Argon2id = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 VAULT_PATH_DEFAULT = "vault.json"
 KDF_ITERATIONS = 200_000 
+# Vaults without a "kdf" header entry (every vault before KDF parameters were
+# stored) use this, and so do new vaults until `calibrate` picks something else.
+KDF_DEFAULT = {"name": "pbkdf2-sha256", "iterations": KDF_ITERATIONS}
+KDF_NAMES = ("pbkdf2-sha256", "scrypt", "argon2id")
+WEAK_PASSWORD_BITS = 60  # estimated entropy below which audit reports a password
+AGENT_IDLE_TIMEOUT = 900  # seconds without a request before the agent locks and exits
+AGENT_SOCKET_ENV = "PASSWORD_MANAGER_AGENT"
 SALT_SIZE = 16  
+KEY_CACHE_TTL = 300  # seconds an unlocked Vault keeps its derived key
+VAULT_VERSION = 3
+COMPACT_THRESHOLD = 256 * 1024  # journal bytes that trigger a background compaction
+REKEY_CHUNK_LINES = 256  # vault lines per re-encryption work item
+
+
+class _Profiler:
+    """Per-phase call counts, wall time and byte counts for one CLI command (see --profile)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}  # name -> [calls, seconds, bytes]
+
+    def add(self, name: str, seconds: float, nbytes: int):
+        stats = self.phases.setdefault(name, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += nbytes
+
+    def report(self, stream: TextIO, command: str):
+        """Write one JSON line per phase, then one for the whole command."""
+        for name, (calls, seconds, nbytes) in self.phases.items():
+            stream.write(json.dumps({"command": command, "phase": name, "calls": calls,
+                                     "ms": round(seconds * 1000, 3), "bytes": nbytes}) + "\n")
+        total = time.perf_counter() - self.started
+        stream.write(json.dumps({"command": command, "phase": "total", "ms": round(total * 1000, 3)}) + "\n")
+
+
+_profiler: Optional[_Profiler] = None
+
+
+def enable_profiling() -> _Profiler:
+    global _profiler
+    _profiler = _Profiler()
+    return _profiler
+
+
+class _Phase:
+    """``with _Phase(name, nbytes):`` charges the block to the active profiler; near-free when profiling is off.
+
+    When the byte count is only known inside the block, set ``nbytes`` on the
+    phase ``with ... as`` returns.
+    """
+
+    __slots__ = ("name", "nbytes", "start")
 
+    def __init__(self, name: str, nbytes: int = 0):
+        self.name = name
+        self.nbytes = nbytes
 
-def derive_key(master_password: str, salt: bytes) -> bytes:
-    
+    def __enter__(self) -> "_Phase":
+        if _profiler is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _profiler is not None:
+            _profiler.add(self.name, time.perf_counter() - self.start, self.nbytes)
+
+
+def derive_key(master_password: str, salt: bytes, kdf: Optional[Dict[str, Any]] = None) -> bytes:
+    """Derive the Fernet master key with the KDF described by ``kdf`` (default: KDF_DEFAULT).
+
+    ``kdf`` is the vault header's parameter dict: ``{"name": "pbkdf2-sha256",
+    "iterations"}``, ``{"name": "scrypt", "n", "r", "p"}`` or
+    ``{"name": "argon2id", "iterations", "memory_cost" (KiB), "lanes"}``.
+    """
+    kdf = kdf or KDF_DEFAULT
     password_bytes = master_password.encode("utf-8")
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=KDF_ITERATIONS,
-        backend=default_backend(),
-    )
-    key = kdf.derive(password_bytes)
+    name = kdf["name"]
+    if name == "pbkdf2-sha256":
+        kdf_impl = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=kdf["iterations"],
+            backend=default_backend(),
+        )
+    elif name == "scrypt":
+        kdf_impl = Scrypt(salt=salt, length=32, n=kdf["n"], r=kdf["r"], p=kdf["p"], backend=default_backend())
+    elif name == "argon2id":
+        if Argon2id is None:
+            raise ValueError("argon2id needs cryptography 44 or newer.")
+        kdf_impl = Argon2id(salt=salt, length=32, iterations=kdf["iterations"],
+                            lanes=kdf["lanes"], memory_cost=kdf["memory_cost"])
+    else:
+        raise ValueError(f"Unknown KDF '{name}'.")
+    with _Phase("kdf:" + name):
+        key = kdf_impl.derive(password_bytes)
     return base64.urlsafe_b64encode(key)
 
 
+def _time_kdf(kdf: Dict[str, Any], repeat: int = 1) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        derive_key("calibration", b"\0" * SALT_SIZE, kdf)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def calibrate_kdf(name: str, target_seconds: float, parallelism: int = 1) -> Dict[str, Any]:
+    """Pick parameters for ``name`` so that one derivation takes about ``target_seconds`` on this host."""
+    if name == "pbkdf2-sha256":
+        # Cost is linear in the iteration count: time a sample and scale.
+        sample = {"name": name, "iterations": 50_000}
+        elapsed = _time_kdf(sample, repeat=3)
+        iterations = int(sample["iterations"] * target_seconds / elapsed)
+        return {"name": name, "iterations": max(iterations, 100_000)}
+    if name == "scrypt":
+        # Memory and time both grow with n (128 * r * n bytes); double n while
+        # the next step still fits the target.
+        kdf = {"name": name, "n": 2 ** 14, "r": 8, "p": parallelism}
+        while kdf["n"] < 2 ** 22 and _time_kdf(kdf) * 2 <= target_seconds:
+            kdf["n"] *= 2
+        return kdf
+    if name == "argon2id":
+        # Start from 64 MiB per derivation, halve it on hosts too slow for a
+        # single pass, then add passes until the target is reached.
+        lanes = max(parallelism, 1)
+        kdf = {"name": name, "iterations": 1, "memory_cost": 64 * 1024, "lanes": lanes}
+        elapsed = _time_kdf(kdf)
+        while elapsed > target_seconds and kdf["memory_cost"] > 8 * 1024:
+            kdf["memory_cost"] //= 2
+            elapsed = _time_kdf(kdf)
+        kdf["iterations"] = max(round(target_seconds / elapsed), 1)
+        return kdf
+    raise ValueError(f"Unknown KDF '{name}'.")
+
+
 def _read_vault_file(path: str) -> Dict[str, Any]:
+    """Read a vault file of any version.
+
+    Version 1 and 2 files are a single JSON object.  Version 3 files are JSON
+    Lines: a header, the encrypted index and one line per record (the
+    snapshot), followed by journal lines appended by later saves, one line
+    per save.  A torn last line left by a crash is ignored, which drops that
+    whole save; ``end`` is the offset after the last good line.
+    """
     if not os.path.exists(path):
         raise FileNotFoundError(f"Vault file not found: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        with _Phase("file-read") as phase:
+            data = f.read()
+            phase.nbytes = len(data)
+        inode = os.fstat(f.fileno()).st_ino
+    # Parsed from memory, so file-read times only the I/O.
+    with _Phase("file-parse", len(data)):
+        f = io.BytesIO(data)
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = {}
+        if header.get("version", 1) < 3:
+            f.seek(0)
+            return json.load(f)
+        obj = dict(header, index=None, records={}, journal=[], inode=inode)
+        end = snapshot_end = f.tell()
+        for line in _iter_log_lines(f):
+            rec = json.loads(line)
+            if "ops" in rec or "op" in rec:
+                obj["journal"].append(rec)
+            elif "index" in rec:
+                obj["index"] = rec["index"]
+            else:
+                obj["records"][rec["id"]] = rec["entry"]
+            end += len(line)
+            if not obj["journal"]:
+                snapshot_end = end
+        if obj["index"] is None:
+            raise ValueError("Corrupted vault: missing index.")
+        obj["end"] = end
+        obj["journal_bytes"] = end - snapshot_end
+        return obj
+
+
+def _iter_log_lines(f: BinaryIO) -> Iterator[bytes]:
+    """Yield the complete lines left in a version 3 vault file, dropping a torn last line."""
+    for line in f:
+        if not line.endswith(b"\n"):
+            break  # only the final write can be cut short: appends truncate back to the last good line
+        yield line
+
+
+def _read_vault_header(path: str) -> Dict[str, Any]:
+    """Like _read_vault_file, but for version 3 files read only the header and index lines."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Vault file not found: {path}")
+    with open(path, "rb") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            header = {}
+        if header.get("version", 1) < 3:
+            f.seek(0)
+            return json.load(f)
+        header["index"] = json.loads(f.readline())["index"]
+        return header
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive advisory lock for writing the vault file at ``path``.
+
+    Every writer (agent, CLI commands, compaction and re-keying) takes it
+    around its check of the file and the append or rename that follows.  It
+    lives on a separate ``path + ".lock"`` file because rewrites replace the
+    vault file itself.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fsync_dir(path: str):
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _atomic_write(path: str, chunks: Iterable[bytes], expect: Optional[os.stat_result] = None) -> os.stat_result:
+    # Write next to the target, fsync and rename over it, so a crash leaves
+    # either the old or the new file, never a half-written vault.  With
+    # ``expect`` the rename only happens if the target is still that file.
+    fd, tmp_path = tempfile.mkstemp(prefix=".vault-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                with _Phase("file-write", len(chunk)):
+                    f.write(chunk)
+            with _Phase("fsync"):
+                f.flush()
+                os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        if expect is not None:
+            current = os.stat(path)
+            if (current.st_ino, current.st_size) != (expect.st_ino, expect.st_size):
+                raise ValueError("Vault file changed on disk while it was being rewritten; try again.")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _fsync_dir(path)
+    return st
+
+
+def _json_line(obj: Dict[str, Any]) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _generate_password() -> str:
+    return base64.urlsafe_b64encode(os.urandom(12)).decode("utf-8").rstrip("=")
+
+
+def _subkey(key: bytes, info: bytes) -> bytes:
+    """Derive an independent Fernet key from the master key."""
+    with _Phase("hkdf"):
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info, backend=default_backend())
+        return base64.urlsafe_b64encode(hkdf.derive(base64.urlsafe_b64decode(key)))
+
+
+def _decrypt_json(key: bytes, token: str) -> Any:
+    try:
+        with _Phase("fernet-decrypt", len(token)):
+            plaintext = Fernet(key).decrypt(token.encode("ascii"))
+    except Exception:
+        raise ValueError("Incorrect master password or corrupted vault.")
+    with _Phase("json-decode", len(plaintext)):
+        return json.loads(plaintext.decode("utf-8"))
+
+
+def _encrypt_json(key: bytes, value: Any) -> str:
+    with _Phase("json-encode") as phase:
+        plaintext = json.dumps(value).encode("utf-8")
+        phase.nbytes = len(plaintext)
+    with _Phase("fernet-encrypt", len(plaintext)):
+        return Fernet(key).encrypt(plaintext).decode("ascii")
+
+
+def _key_check(key: bytes) -> str:
+    """Short MAC of a constant under ``key``, kept in the header to verify a password without decrypting."""
+    check_key = base64.urlsafe_b64decode(_subkey(key, b"check"))
+    return base64.b64encode(hmac.new(check_key, b"password_manager key check", hashlib.sha256).digest()[:16]).decode("ascii")
+
+
+def _header_line(salt: bytes, kdf: Dict[str, Any], key: bytes) -> bytes:
+    return _json_line({"version": VAULT_VERSION, "salt": base64.b64encode(salt).decode("utf-8"),
+                       "kdf": kdf, "check": _key_check(key)})
+
+
+def _decrypt_v1(key: bytes, data: str) -> Dict[str, Dict[str, str]]:
+    # Version 1 files hold the whole vault as one base64-wrapped Fernet token:
+    # { "site_or_label": { "username": "...", "password": "...", "notes": "..." }, ... }
+    with _Phase("base64", len(data)):
+        token = base64.b64decode(data).decode("ascii")
+    return _decrypt_json(key, token)
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+_WORD_RE = re.compile(r"[^\W_]+")  # runs of letters and digits
+
+
+def _one_edit(word: str, letters: str, known: Container[str]) -> Dict[str, float]:
+    """The ``known`` words one edit from ``word`` (a deletion, adjacent swap, substitution or insertion) and its cost.
+
+    An insertion costs half: a word holding every letter typed, plus one
+    that was left out, is a closer match than one with a letter changed.
+    """
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    edits = itertools.chain((a + b[1:] for a, b in splits if b),
+                            (a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1),
+                            (a + c + b[1:] for a, b in splits if b for c in letters))
+    near = {w: 1.0 for w in edits if w in known}
+    near.update({w: 0.5 for w in (a + c + b for a, b in splits for c in letters) if w in known})
+    near.pop(word, None)
+    return near
+
+
+class _SearchIndex:
+    """Trigram and prefix index over entry labels, usernames and notes.
+
+    Posting lists map each trigram to ``doc id * 3 + field``, so counting how
+    often a posting turns up across the query's trigrams gives the number of
+    trigrams that field shares with the query.  Trigrams present in more than
+    1/COMMON_RATIO of the documents are skipped (beyond the two rarest), the
+    way a text index skips stop words, which keeps the count to a few short
+    lists.  Scores weight the shared-trigram ratio by field, with bonuses for
+    exact, prefix and substring label matches.
+
+    A typo breaks most of a word's few trigrams, so the index also maps every
+    word (a run of letters and digits) to its postings.  Each query word of
+    at least TYPO_WORD_LENGTH characters that is not a known word is looked
+    up as every string one edit away from it, which takes a few hundred dict
+    lookups whatever the vault's size; fields holding a match for every
+    query word are accepted, scored by how much of the query they match
+    exactly ("gmial" finds "me@gmail.com", "rira.com" finds "rigra.com-1").
+    At most TYPO_POSTINGS fields are checked this way per query, and the
+    trigram count reads at most as many postings per trigram as make one
+    common.
+    """
+
+    FIELD_WEIGHTS = (1.0, 0.6, 0.4)  # label, username, notes
+    COMMON_RATIO = 100
+    MIN_SIMILARITY = 0.5  # share of query trigrams a field must contain to match
+    PREFIX_SCAN = 200  # label prefix matches considered per query
+    TYPO_WORD_LENGTH = 4  # shortest query word matched with a typo
+    TYPO_QUERY_WORDS = 3  # longest query, in words, matched with typos
+    TYPO_POSTINGS = 128  # fields checked for typo matches per query
+    TYPO_LETTERS = "abcdefghijklmnopqrstuvwxyz0123456789"  # inserted or substituted by a typo, besides the word's own
+
+    def __init__(self):
+        self._docs: List[Optional[Tuple[str, str, str]]] = []  # casefolded fields; None once removed
+        self._labels: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._grams: Dict[str, List[int]] = {}  # trigram -> [doc id * 3 + field]
+        self._sorted: List[Tuple[str, int]] = []  # (casefolded label, doc id)
+        self._words: Dict[str, List[int]] = {}  # word -> [doc id * 3 + field]
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[str, str, str]]) -> "_SearchIndex":
+        index = cls()
+        for label, username, notes in entries:
+            index._sorted.append(index._add(label, username, notes))
+        index._sorted.sort()
+        return index
+
+    def _add(self, label: str, username: str, notes: str) -> Tuple[str, int]:
+        doc_id = len(self._docs)
+        fields = (label.casefold(), username.casefold(), notes.casefold())
+        self._docs.append(fields)
+        self._labels.append(label)
+        self._ids[label] = doc_id
+        for field, text in enumerate(fields):
+            for gram in _trigrams(text):
+                self._grams.setdefault(gram, []).append(doc_id * 3 + field)
+            for word in set(_WORD_RE.findall(text)):
+                self._words.setdefault(word, []).append(doc_id * 3 + field)
+        return fields[0], doc_id
+
+    def add(self, label: str, username: str, notes: str):
+        self.remove(label)
+        bisect.insort(self._sorted, self._add(label, username, notes))
+
+    def remove(self, label: str):
+        doc_id = self._ids.pop(label, None)
+        if doc_id is None:
+            return
+        del self._sorted[bisect.bisect_left(self._sorted, (self._docs[doc_id][0], doc_id))]
+        self._docs[doc_id] = None  # posting entries of removed docs are skipped at query time
+
+    def _ranked(self, scores: Dict[int, float], limit: int) -> List[Tuple[str, float]]:
+        best = heapq.nlargest(limit, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+        return [(self._labels[doc_id], round(score, 3)) for doc_id, score in best]
+
+    def _typo_matches(self, q: str, limit: int) -> Dict[int, float]:
+        """Scores of the docs with a field matching every word of ``q``, some of them one edit off."""
+        words = _WORD_RE.findall(q)
+        if not words or len(words) > self.TYPO_QUERY_WORDS:
+            return {}
+        near = []  # per query word: {known word: 0 if exact, else the cost of the edit}
+        for word in words:
+            if word in self._words:
+                near.append({word: 0.0})
+            elif len(word) >= self.TYPO_WORD_LENGTH:
+                near.append(_one_edit(word, self.TYPO_LETTERS + word, self._words))
+                if not near[-1]:
+                    return {}
+            else:
+                return {}
+        if not any(any(matches.values()) for matches in near):
+            return {}  # no typos: the trigram pass already found these
+        # The query word with the fewest postings picks the fields to check, its
+        # cheapest matches first; the other words are looked for in each field
+        # with one regex each, the cheapest of the matches found counting.
+        rarest = min(range(len(near)), key=lambda i: sum(len(self._words[w]) for w in near[i]))
+        others = [(matches, re.compile(rf"(?<![^\W_])({'|'.join(map(re.escape, matches))})(?![^\W_])").findall)
+                  for i, matches in enumerate(near) if i != rarest]
+        candidates = ((posting, cost) for w, cost in sorted(near[rarest].items(), key=lambda kv: kv[1])
+                      for posting in self._words[w])
+        length = len("".join(words))
+        floor = sum(min(matches.values()) for matches, _ in others)  # the least the other words can cost
+        scores: Dict[int, float] = {}
+        for n, (posting, typos) in enumerate(itertools.islice(candidates, self.TYPO_POSTINGS)):
+            if n % 32 == 0 and len(scores) >= limit:
+                # Stop once no later field, even a label, can beat the results so far.
+                best = self.FIELD_WEIGHTS[0] * 0.9 * (1 - (typos + floor) / length)
+                if heapq.nlargest(limit, scores.values())[-1] >= best:
+                    break
+            doc_id, field = divmod(posting, 3)
+            fields = self._docs[doc_id]
+            if fields is None:
+                continue
+            for matches, findall in others:
+                found = findall(fields[field])
+                if not found:
+                    break
+                typos += min(map(matches.get, found))
+            else:
+                # Like the trigram score, the share of the query matched: here its characters, less one per typo.
+                score = self.FIELD_WEIGHTS[field] * 0.9 * (1 - typos / length)
+                if score > scores.get(doc_id, 0.0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        q = query.casefold().strip()
+        if not q:
+            return []
+        scores: Dict[int, float] = {}
+        i = bisect.bisect_left(self._sorted, (q,))
+        for key, doc_id in self._sorted[i:i + self.PREFIX_SCAN]:
+            if not key.startswith(q):
+                break
+            scores[doc_id] = 2.0 + len(q) / len(key) + (1.0 if key == q else 0.0)
+        if len(scores) >= limit:
+            return self._ranked(scores, limit)  # fuzzy matches score below 2.0
+
+        qgrams = _trigrams(q)
+        known = sorted((g for g in qgrams if g in self._grams), key=lambda g: len(self._grams[g]))
+        common = max(len(self._docs) // self.COMMON_RATIO, 100)
+        used = [g for n, g in enumerate(known) if n < 2 or len(self._grams[g]) <= common]
+        total = len(used) + len(qgrams) - len(known)
+        hits = collections.Counter()
+        if len(used) >= self.MIN_SIMILARITY * total:
+            # The two rarest trigrams can still be common; reading only the start of
+            # their lists drops fields among thousands of equal matches, while exact
+            # and prefix label matches come from the sorted labels above.
+            hits.update(itertools.chain.from_iterable(itertools.islice(self._grams[g], common) for g in used))
+        need = self.MIN_SIMILARITY * total
+        similar = [(posting, count) for posting, count in hits.items() if count >= need]
+        for posting, count in heapq.nlargest(limit * 5, similar, key=lambda kv: kv[1]):
+            doc_id, field = divmod(posting, 3)
+            fields = self._docs[doc_id]
+            if fields is None:
+                continue
+            score = self.FIELD_WEIGHTS[field] * count / total
+            if field == 0 and q in fields[0]:
+                score += 0.5
+            if score > scores.get(doc_id, 0.0):
+                scores[doc_id] = score
+        for doc_id, score in self._typo_matches(q, limit).items():
+            if score > scores.get(doc_id, 0.0):
+                scores[doc_id] = score
+        return self._ranked(scores, limit)
+
+
+class Vault:
+    """An unlocked vault session.
+
+    Every entry is its own Fernet token, encrypted under a key derived from
+    the master key and the entry's random record id, next to an encrypted
+    ``{label: record id}`` index.  Reading an entry decrypts just that record
+    and changing one re-encrypts just that record.
+
+    save() appends the pending changes to the vault file as one journal line
+    (the encrypted, sequence-numbered operations plus the new records) and
+    fsyncs, so an update costs a few hundred bytes instead of a rewrite of the
+    whole vault, and a save is committed entirely or, if the line is torn, not
+    at all.  Once the journal grows past COMPACT_THRESHOLD a background thread
+    writes a fresh snapshot and renames it over the file; readers always see
+    either the old or the new file.
+
+    The key is derived once by ``unlock`` and reused for every read and write
+    until the session is locked.  With a ``ttl`` the key is only cached for that
+    many seconds: on expiry the key buffer is zeroed, the decrypted entries are
+    dropped and further calls raise ValueError until the vault is unlocked again.
+    """
+
+    def __init__(self, path: str, salt: bytes, key: bytes, index: Dict[str, str], records: Dict[str, str],
+                 ttl: Optional[float] = KEY_CACHE_TTL, kdf: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.salt = salt
+        self.kdf = kdf or dict(KDF_DEFAULT)
+        self._key = bytearray(key)
+        self._index = index
+        self._records = records
+        self._cache: Dict[str, Dict[str, str]] = {}
+        self._search: Optional[_SearchIndex] = None  # built by the first search()
+        self._pending: Dict[str, Dict[str, str]] = {}  # label -> latest unsaved op
+        # On-disk state: last committed sequence number, expected file identity
+        # and length, and how much of it is journal.  _inode is None until the
+        # vault has been written in the current format.
+        self._seq = 0
+        self._inode = None
+        self._end = 0
+        self._journal_bytes = 0
+        self._compactor: Optional[threading.Thread] = None
+        self._compact_tail: Optional[List[bytes]] = None
+        self._lock = threading.Lock()
+        self._timer = None
+        if ttl is not None:
+            self._timer = threading.Timer(ttl, self.lock)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @classmethod
+    def create(cls, path: str, master_password: str, ttl: Optional[float] = KEY_CACHE_TTL,
+               kdf: Optional[Dict[str, Any]] = None) -> "Vault":
+        """Start a new, empty vault for ``path`` with a fresh salt; nothing is written until save()."""
+        salt = secrets.token_bytes(SALT_SIZE)
+        return cls(path, salt, derive_key(master_password, salt, kdf), {}, {}, ttl, kdf)
+
+    @classmethod
+    def unlock(cls, path: str, master_password: str, ttl: Optional[float] = KEY_CACHE_TTL) -> "Vault":
+        obj = _read_vault_file(path)
+        salt = base64.b64decode(obj["salt"])
+        kdf = obj.get("kdf", KDF_DEFAULT)
+        key = derive_key(master_password, salt, kdf)
+        version = obj.get("version", 1)
+        if version == 1:
+            vault = cls(path, salt, key, {}, {}, ttl, kdf)
+            for label, item in _decrypt_v1(key, obj["data"]).items():
+                vault.set(label, item.get("username", ""), item.get("password", ""), item.get("notes", ""))
+            vault.save()
+            return vault
+        if version == 2:
+            index = _decrypt_json(_subkey(key, b"index"), obj["index"])
+            vault = cls(path, salt, key, index, obj["records"], ttl, kdf)
+            vault.save()
+            return vault
+        vault = cls(path, salt, key, {}, {}, ttl, kdf)
+        vault._load(obj)
+        return vault
+
+    def _load(self, obj: Dict[str, Any]):
+        """Replace the in-memory state with a version 3 file's snapshot plus journal."""
+        index_key = _subkey(bytes(self._key), b"index")
+        snapshot = _decrypt_json(index_key, obj["index"])
+        index, records, seq = snapshot["labels"], obj["records"], snapshot["seq"]
+        for rec in obj["journal"]:
+            if "ops" in rec:
+                ops, entries = _decrypt_json(index_key, rec["ops"]), rec["entries"]
+            else:  # one line per operation, as older versions wrote the journal
+                ops = [_decrypt_json(index_key, rec["op"])]
+                entries = {ops[0]["id"]: rec["entry"]} if "entry" in rec else {}
+            for op in ops:
+                if op["seq"] != seq + 1:
+                    raise ValueError("Corrupted vault journal (out of sequence).")
+                seq = op["seq"]
+                old_id = index.pop(op["label"], None)
+                if old_id is not None:
+                    records.pop(old_id, None)
+                if op["op"] == "put":
+                    index[op["label"]] = op["id"]
+                    records[op["id"]] = entries[op["id"]]
+        self._index, self._records, self._cache = index, records, {}
+        self._search = None
+        self._seq = seq
+        self._inode = obj["inode"]
+        self._end = obj["end"]
+        self._journal_bytes = obj["journal_bytes"]
+
+    def refresh(self) -> bool:
+        """Pick up changes another process wrote to the file, reusing the cached key.
+
+        Returns True if the vault was reloaded.  Raises ValueError if the file
+        was re-keyed (new salt or KDF), since the cached key no longer opens it.
+        """
+        with self._lock:
+            self._check()
+            if self._pending or self._inode is None or self._compactor is not None:
+                return False
+            st = os.stat(self.path)
+            if st.st_ino == self._inode and st.st_size == self._end:
+                return False
+            obj = _read_vault_file(self.path)
+            if (obj.get("version", 1) < 3 or base64.b64decode(obj["salt"]) != self.salt
+                    or obj.get("kdf", KDF_DEFAULT) != self.kdf):
+                raise ValueError("Vault was re-keyed on disk; unlock it again.")
+            self._load(obj)
+            return True
+
+    @property
+    def locked(self) -> bool:
+        return not any(self._key)
+
+    def _check(self):
+        if self.locked:
+            raise ValueError("Vault is locked (session expired); unlock it again.")
+
+    def _record_key(self, record_id: str) -> bytes:
+        return _subkey(bytes(self._key), b"record:" + record_id.encode("ascii"))
+
+    def __contains__(self, label: str) -> bool:
+        self._check()
+        return label in self._index
+
+    def __len__(self) -> int:
+        self._check()
+        return len(self._index)
+
+    def labels(self) -> List[str]:
+        self._check()
+        return sorted(self._index)
+
+    def get(self, label: str) -> Optional[Dict[str, str]]:
+        self._check()
+        record_id = self._index.get(label)
+        if record_id is None:
+            return None
+        item = self._cache.get(label)
+        if item is None:
+            item = _decrypt_json(self._record_key(record_id), self._records[record_id])
+            self._cache[label] = item
+        return item
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, str]]]:
+        for label in self.labels():
+            yield label, self.get(label)
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Rank entries by fuzzy match of ``query`` against labels, usernames and notes.
+
+        The index is built (decrypting every entry once) on the first call and
+        kept up to date by set() and delete() for the rest of the session.
+        """
+        self._check()
+        if self._search is None:
+            self._search = _SearchIndex.build(
+                (label, item.get("username", ""), item.get("notes", "")) for label, item in self.items())
+        return self._search.search(query, limit)
+
+    def set(self, label: str, username: str, password: str, notes: str):
+        self._check()
+        item = {"username": username, "password": password, "notes": notes}
+        # A fresh record id per write keeps journal replay simple: a put
+        # always retires whatever record the label pointed at before.
+        record_id = secrets.token_hex(8)
+        old_id = self._index.get(label)
+        if old_id is not None:
+            del self._records[old_id]
+        self._records[record_id] = _encrypt_json(self._record_key(record_id), item)
+        self._index[label] = record_id
+        self._cache[label] = item
+        if self._search is not None:
+            self._search.add(label, username, notes)
+        self._pending.pop(label, None)
+        self._pending[label] = {"op": "put", "label": label, "id": record_id}
+
+    def delete(self, label: str) -> bool:
+        self._check()
+        record_id = self._index.pop(label, None)
+        if record_id is None:
+            return False
+        del self._records[record_id]
+        self._cache.pop(label, None)
+        if self._search is not None:
+            self._search.remove(label)
+        self._pending.pop(label, None)
+        self._pending[label] = {"op": "del", "label": label}
+        return True
+
+    def _snapshot_lines(self, index_token: str, records: Dict[str, str]) -> Iterator[bytes]:
+        yield _header_line(self.salt, self.kdf, bytes(self._key))
+        yield _json_line({"index": index_token})
+        for record_id, token in records.items():
+            yield _json_line({"id": record_id, "entry": token})
 
+    def _index_token(self) -> str:
+        return _encrypt_json(_subkey(bytes(self._key), b"index"), {"seq": self._seq, "labels": self._index})
 
-def _write_vault_file(path: str, obj: Dict[str, Any]):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2)
+    def save(self):
+        with self._lock:
+            self._check()
+            if self._inode is None:
+                with _file_lock(self.path):
+                    st = _atomic_write(self.path, self._snapshot_lines(self._index_token(), self._records))
+                self._inode, self._end, self._journal_bytes = st.st_ino, st.st_size, 0
+            elif self._pending:
+                self._append_journal()
+            self._pending = {}
+            compact = self._journal_bytes > COMPACT_THRESHOLD and self._compactor is None
+            if compact:
+                index_token, records = self._index_token(), dict(self._records)
+                self._compact_tail = []
+                self._compactor = threading.Thread(target=self._compact, args=(index_token, records))
+                self._compactor.start()
+
+    def _append_journal(self):
+        index_key = _subkey(bytes(self._key), b"index")
+        ops, entries = [], {}
+        seq = self._seq
+        for op in self._pending.values():
+            seq += 1
+            ops.append(dict(op, seq=seq))
+            if op["op"] == "put":
+                entries[op["id"]] = self._records[op["id"]]
+        # The whole save is a single line, so a torn append loses all of a batch, never part of it.
+        data = _json_line({"ops": _encrypt_json(index_key, ops), "entries": entries})
+        with _file_lock(self.path), open(self.path, "r+b") as f:
+            st = os.fstat(f.fileno())
+            f.seek(self._end)
+            if st.st_ino != self._inode or st.st_size < self._end or b"\n" in f.read():
+                raise ValueError("Vault file changed on disk since it was unlocked; unlock it again.")
+            # Anything past our end offset is a torn line from a crashed write.
+            f.seek(self._end)
+            f.truncate()
+            with _Phase("file-append", len(data)):
+                f.write(data)
+            with _Phase("fsync"):
+                f.flush()
+                os.fsync(f.fileno())
+        self._seq = seq
+        self._end += len(data)
+        self._journal_bytes += len(data)
+        if self._compact_tail is not None:
+            self._compact_tail.append(data)
+
+    def _compact(self, index_token: str, records: Dict[str, str]):
+        # Build the new snapshot without holding the lock, then copy over the
+        # journal lines appended meanwhile and swap the files under the lock.
+        fd, tmp_path = tempfile.mkstemp(prefix=".vault-", dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self._snapshot_lines(index_token, records):
+                    f.write(chunk)
+                with self._lock:
+                    tail = b"".join(self._compact_tail)
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    st = os.fstat(f.fileno())
+                    with _file_lock(self.path):
+                        current = os.stat(self.path)
+                        if current.st_ino != self._inode or current.st_size != self._end:
+                            raise OSError("vault changed during compaction")
+                        os.replace(tmp_path, self.path)
+                        _fsync_dir(self.path)
+                    self._inode, self._end, self._journal_bytes = st.st_ino, st.st_size, len(tail)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        finally:
+            with self._lock:
+                self._compact_tail = None
+                self._compactor = None
+
+    def lock(self):
+        """Zero the cached key and forget the decrypted entries."""
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            # Fernet keeps private copies of the key material, so only this
+            # buffer can be wiped; no Fernet instance outlives a single call.
+            for i in range(len(self._key)):
+                self._key[i] = 0
+            self._index = {}
+            self._records = {}
+            self._cache = {}
+            self._search = None
+            self._pending = {}
+
+    def __enter__(self) -> "Vault":
+        return self
+
+    def __exit__(self, *exc):
+        self.lock()
+
+
+def _verify_master(obj: Dict[str, Any], master_password: str) -> bytes:
+    """Return the master key, or raise ValueError unless ``master_password`` opens the vault payload ``obj``.
+
+    Uses the header's key check when there is one, otherwise decrypts the
+    index (or the whole version 1 blob).
+    """
+    key = derive_key(master_password, base64.b64decode(obj["salt"]), obj.get("kdf"))
+    if "check" in obj:
+        if not constant_time.bytes_eq(_key_check(key).encode("ascii"), obj["check"].encode("ascii")):
+            raise ValueError("Incorrect master password or corrupted vault.")
+    elif obj.get("version", 1) == 1:
+        _decrypt_v1(key, obj["data"])
+    else:
+        _decrypt_json(_subkey(key, b"index"), obj["index"])
+    return key
 
 
 def init_vault(path: str, master_password: str):
     if os.path.exists(path):
         print("Vault already exists at", path)
         return
-    salt = secrets.token_bytes(SALT_SIZE)
-    key = derive_key(master_password, salt)
-    f = Fernet(key)
-    empty = {}
-    token = f.encrypt(json.dumps(empty).encode("utf-8"))
-    payload = {
-        "salt": base64.b64encode(salt).decode("utf-8"),
-        "data": base64.b64encode(token).decode("utf-8"),
-    }
-    _write_vault_file(path, payload)
+    with Vault.create(path, master_password) as vault:
+        vault.save()
     print("Initialized new vault at", path)
 
 
 def load_vault(path: str, master_password: str) -> Dict[str, Dict[str, str]]:
-    obj = _read_vault_file(path)
-    salt = base64.b64decode(obj["salt"])
-    token = base64.b64decode(obj["data"])
-    key = derive_key(master_password, salt)
-    f = Fernet(key)
-    try:
-        plaintext = f.decrypt(token)
-    except Exception:
-        raise ValueError("Incorrect master password or corrupted vault.")
-    vault = json.loads(plaintext.decode("utf-8"))
-    # Expected vault format: { "site_or_label": { "username": "...", "password": "...", "notes": "..." }, ... }
-    return vault
+    with Vault.unlock(path, master_password) as vault:
+        return dict(vault.items())
 
 
 def save_vault(path: str, master_password: str, vault: Dict[str, Dict[str, str]]):
-    obj = _read_vault_file(path)
-    salt = base64.b64decode(obj["salt"])
-    key = derive_key(master_password, salt)
-    f = Fernet(key)
-    token = f.encrypt(json.dumps(vault).encode("utf-8"))
-    new_obj = {
-        "salt": base64.b64encode(salt).decode("utf-8"),
-        "data": base64.b64encode(token).decode("utf-8"),
-    }
-    _write_vault_file(path, new_obj)
+    with Vault.unlock(path, master_password) as session:
+        for label in session.labels():
+            if label not in vault:
+                session.delete(label)
+        for label, item in vault.items():
+            if session.get(label) != item:
+                session.set(label, item.get("username", ""), item.get("password", ""), item.get("notes", ""))
+        session.save()
 
 
 def add_entry(path: str, master_password: str, label: str, username: str, password: str, notes: str):
-    vault = load_vault(path, master_password)
-    if label in vault:
-        print(f"Warning: '{label}' already exists and will be overwritten.")
-    vault[label] = {"username": username, "password": password, "notes": notes}
-    save_vault(path, master_password, vault)
+    with Vault.unlock(path, master_password) as vault:
+        if label in vault:
+            print(f"Warning: '{label}' already exists and will be overwritten.")
+        vault.set(label, username, password, notes)
+        vault.save()
     print("Saved entry:", label)
 
 
 def get_entry(path: str, master_password: str, label: str):
-    vault = load_vault(path, master_password)
-    item = vault.get(label)
+    with Vault.unlock(path, master_password) as vault:
+        _print_entry(label, vault.get(label))
+
+
+def _print_entry(label: str, item: Optional[Dict[str, str]]):
     if not item:
         print(f"No entry named '{label}' found.")
         return
@@ -115,51 +941,340 @@ def get_entry(path: str, master_password: str, label: str):
 
 
 def list_entries(path: str, master_password: str):
-    vault = load_vault(path, master_password)
-    if not vault:
+    with Vault.unlock(path, master_password) as vault:
+        _print_labels(vault.labels())
+
+
+def _print_labels(labels: List[str]):
+    if not labels:
         print("Vault empty.")
         return
     print("Entries:")
-    for label in sorted(vault.keys()):
+    for label in labels:
         print(" -", label)
 
 
-def delete_entry(path: str, master_password: str, label: str):
-    vault = load_vault(path, master_password)
-    if label not in vault:
-        print(f"No entry named '{label}'.")
+def search_entries(path: str, master_password: str, query: str, limit: int = 10):
+    with Vault.unlock(path, master_password) as vault:
+        _print_search([(label, vault.get(label)["username"], score) for label, score in vault.search(query, limit)])
+
+
+def _print_search(results: List[Tuple[str, str, float]]):
+    if not results:
+        print("No matching entries.")
         return
-    del vault[label]
-    save_vault(path, master_password, vault)
+    for label, username, score in results:
+        print(f" - {label}  ({username})  [{score:.2f}]")
+
+
+# Words and keyboard runs that passwords are most often built around.  A
+# password containing one is guessed by trying the list with a few digits
+# and symbols around it, not letter by letter.
+COMMON_PASSWORD_WORDS = frozenset("""
+password passwd passw0rd letmein welcome admin administrator login master secret qwerty qwertz azerty
+asdf asdfgh zxcvbn qazwsx iloveyou love lovely princess sunshine shadow monkey dragon football baseball
+soccer hockey batman superman starwars pokemon computer internet whatever freedom trustno1 hello
+summer winter spring autumn january february march april june july august september october november
+december monday friday michael jessica jennifer charlie thomas daniel jordan hunter ranger buster
+tigger ginger pepper cookie cheese banana orange purple silver golden diamond flower angel happy
+killer hannah maggie harley matrix mustang ferrari access changeme default guest user test
+""".split())
+_LEET = str.maketrans("@4301$5!7", "aaeoissit")
+
+
+def password_entropy(password: str) -> float:
+    """Estimate a password's entropy in bits from its character pool and effective length.
+
+    Characters repeating the previous one or continuing an ascending or
+    descending run ("aaa", "abc", "321") count as a quarter of a character.
+    A common word (see COMMON_PASSWORD_WORDS, also spelt with digits or
+    symbols for letters) counts as one pick from that list, plus a bit if
+    it is capitalised, so "Password1!" is weak however many character
+    classes it uses.
+    """
+    pool = 0
+    if any(c.islower() for c in password):
+        pool += 26
+    if any(c.isupper() for c in password):
+        pool += 26
+    if any(c.isdigit() for c in password):
+        pool += 10
+    if any(not c.isalnum() and c.isascii() for c in password):
+        pool += 33
+    if any(not c.isascii() for c in password):
+        pool += 100
+    if not pool:
+        return 0.0
+    plain = password.lower().translate(_LEET)
+    longest = max(map(len, COMMON_PASSWORD_WORDS))
+    bits = 0.0
+    i = 0
+    while i < len(password):
+        word = next((plain[i:i + n] for n in range(min(longest, len(plain) - i), 3, -1)
+                     if plain[i:i + n] in COMMON_PASSWORD_WORDS), None)
+        if word:
+            bits += math.log2(len(COMMON_PASSWORD_WORDS)) + any(c.isupper() for c in password[i:i + len(word)])
+            i += len(word)
+            continue
+        step = ord(password[i]) - ord(password[i - 1]) if i else None
+        bits += (0.25 if step in (-1, 0, 1) else 1.0) * math.log2(pool)
+        i += 1
+    return bits
+
+
+def _strength(bits: float) -> str:
+    if bits < 28:
+        return "very weak"
+    if bits < 36:
+        return "weak"
+    if bits < 60:
+        return "fair"
+    return "strong"
+
+
+class _BreachList:
+    """Memory-mapped lookup in a sorted breached-password list.
+
+    The file holds one ``SHA1HEX[:count]`` line per password sorted by hash, as
+    in the "ordered by hash" Pwned Passwords downloads.  Lookups binary-search
+    the mapping, so even a multi-GB list is never read into memory.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        # An empty file can't be mapped; it simply holds no hashes.
+        self._mm = None
+        if os.fstat(self._file.fileno()).st_size:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def count(self, sha1_hex: str) -> int:
+        """Times the password with this SHA-1 was seen in breaches (0 if absent)."""
+        target = sha1_hex.upper().encode("ascii")
+        mm = self._mm
+        if mm is None:
+            return 0
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            start = mm.rfind(b"\n", 0, (lo + hi) // 2) + 1
+            start = max(start, lo)
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = len(mm)
+            line = mm[start:end].strip()
+            key = line[:40].upper()
+            if key == target:
+                _, _, count = line.partition(b":")
+                return int(count) if count.strip().isdigit() else 1
+            if key < target:
+                lo = end + 1
+            else:
+                hi = start
+        return 0
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self) -> "_BreachList":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def audit_vault(path: str, master_password: str, breach_path: Optional[str] = None) -> Dict[str, Any]:
+    """Report reused, weak and (given a breach list) breached passwords."""
+    by_hash: Dict[str, List[str]] = {}
+    weak: List[Tuple[str, float]] = []
+    with Vault.unlock(path, master_password) as vault:
+        for label, item in vault.items():
+            password = item.get("password", "")
+            by_hash.setdefault(hashlib.sha1(password.encode("utf-8")).hexdigest(), []).append(label)
+            bits = password_entropy(password)
+            if bits < WEAK_PASSWORD_BITS:
+                weak.append((label, bits))
+    reused = [labels for labels in by_hash.values() if len(labels) > 1]
+    breached: List[Tuple[str, int]] = []
+    if breach_path is not None:
+        with _BreachList(breach_path) as breaches:
+            for digest in sorted(by_hash):
+                seen = breaches.count(digest)
+                if seen:
+                    breached.extend((label, seen) for label in by_hash[digest])
+
+    print(f"Audited {sum(len(labels) for labels in by_hash.values())} entries.")
+    print("Reused passwords:" if reused else "No reused passwords.")
+    for labels in reused:
+        print(f"  - {', '.join(labels)} ({len(labels)} entries)")
+    print("Weak passwords:" if weak else "No weak passwords.")
+    for label, bits in sorted(weak, key=lambda lb: lb[1]):
+        print(f"  - {label}: ~{bits:.0f} bits ({_strength(bits)})")
+    if breach_path is not None:
+        print("Breached passwords:" if breached else "No breached passwords.")
+        for label, seen in breached:
+            print(f"  - {label}: seen {seen} times")
+    return {"reused": reused, "weak": weak, "breached": breached}
+
+
+def delete_entry(path: str, master_password: str, label: str):
+    with Vault.unlock(path, master_password) as vault:
+        if not vault.delete(label):
+            print(f"No entry named '{label}'.")
+            return
+        vault.save()
     print("Deleted entry:", label)
 
 
-def change_master(path: str, old_master: str, new_master: str):
-    vault = load_vault(path, old_master) 
-   
-    new_salt = secrets.token_bytes(SALT_SIZE)
-    new_key = derive_key(new_master, new_salt)
-    f = Fernet(new_key)
-    encrypted = f.encrypt(json.dumps(vault).encode("utf-8"))
-    payload = {
-        "salt": base64.b64encode(new_salt).decode("utf-8"),
-        "data": base64.b64encode(encrypted).decode("utf-8"),
-    }
-    _write_vault_file(path, payload)
+def _iter_batch_records(stream: TextIO) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Yield (line number, record) from JSON Lines or CSV-with-header input."""
+    first = stream.readline()
+    while first and not first.strip():
+        first = stream.readline()
+    if first.lstrip().startswith("{"):
+        for lineno, line in enumerate(itertools.chain([first], stream), start=1):
+            if line.strip():
+                yield lineno, json.loads(line)
+    else:
+        reader = csv.DictReader(itertools.chain([first], stream))
+        for record in reader:
+            yield reader.line_num, record
+
+
+def apply_batch(path: str, master_password: str, stream: TextIO) -> Dict[str, int]:
+    """Apply every upsert/delete record from ``stream`` and save the vault once."""
+    counts = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
+    with Vault.unlock(path, master_password) as vault:
+        for lineno, record in _iter_batch_records(stream):
+            label = (record.get("label") or "").strip()
+            op = (record.get("op") or "upsert").strip().lower()
+            if not label:
+                print(f"line {lineno}: skipped (missing label)")
+                counts["skipped"] += 1
+            elif op == "delete":
+                if vault.delete(label):
+                    print(f"line {lineno}: deleted {label}")
+                    counts["deleted"] += 1
+                else:
+                    print(f"line {lineno}: skipped {label} (no such entry)")
+                    counts["skipped"] += 1
+            elif op == "upsert":
+                status = "updated" if label in vault else "added"
+                password = record.get("password") or _generate_password()
+                vault.set(label, record.get("username") or "", password, record.get("notes") or "")
+                print(f"line {lineno}: {status} {label}")
+                counts[status] += 1
+            else:
+                print(f"line {lineno}: skipped {label} (unknown op '{op}')")
+                counts["skipped"] += 1
+        if counts["added"] or counts["updated"] or counts["deleted"]:
+            vault.save()
+    print("Applied batch: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+    return counts
+
+
+def _rekey_record(old_key: bytes, new_key: bytes, record_id: str, token: str) -> str:
+    info = b"record:" + record_id.encode("ascii")
+    return _encrypt_json(_subkey(new_key, info), _decrypt_json(_subkey(old_key, info), token))
+
+
+def _rekey_lines(old_key: bytes, new_key: bytes, lines: List[bytes]) -> List[bytes]:
+    """Re-encrypt a run of version 3 vault lines (index, records or journal) from ``old_key`` to ``new_key``."""
+    old_index, new_index = _subkey(old_key, b"index"), _subkey(new_key, b"index")
+    out = []
+    for line in lines:
+        rec = json.loads(line)
+        if "index" in rec:
+            rec["index"] = _encrypt_json(new_index, _decrypt_json(old_index, rec["index"]))
+        elif "ops" in rec:
+            rec["ops"] = _encrypt_json(new_index, _decrypt_json(old_index, rec["ops"]))
+            rec["entries"] = {record_id: _rekey_record(old_key, new_key, record_id, token)
+                              for record_id, token in rec["entries"].items()}
+        elif "op" in rec:
+            op = _decrypt_json(old_index, rec["op"])
+            rec["op"] = _encrypt_json(new_index, op)
+            if "entry" in rec:
+                rec["entry"] = _rekey_record(old_key, new_key, op["id"], rec["entry"])
+        else:
+            rec["entry"] = _rekey_record(old_key, new_key, rec["id"], rec["entry"])
+        out.append(_json_line(rec))
+    return out
+
+
+def _rekey_stream(old_key: bytes, new_key: bytes, chunks: Iterator[List[bytes]], workers: int) -> Iterator[bytes]:
+    # Keep at most two chunks per worker in flight and emit results in file
+    # order, so memory stays bounded by the chunk size, not the vault size.
+    # Reading up to ``workers`` chunks ahead sizes the pool: a vault of one
+    # chunk (most of them) is re-encrypted here without starting processes.
+    ahead = list(itertools.islice(chunks, max(workers, 1)))
+    if len(ahead) <= 1:
+        for chunk in itertools.chain(ahead, chunks):
+            yield from _rekey_lines(old_key, new_key, chunk)
+        return
+    workers = len(ahead)
+    with ProcessPoolExecutor(workers) as pool:
+        in_flight: collections.deque = collections.deque()
+        for chunk in itertools.chain(ahead, chunks):
+            in_flight.append(pool.submit(_rekey_lines, old_key, new_key, chunk))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def _rekey(path: str, old_master: str, new_master: str, kdf: Optional[Dict[str, Any]] = None,
+           workers: Optional[int] = None):
+    """Re-encrypt the vault under a fresh salt, ``new_master`` and ``kdf`` (default: keep the current KDF).
+
+    The file is streamed line by line and re-encrypted in chunks of
+    REKEY_CHUNK_LINES on ``workers`` processes (default: one per CPU, never
+    more than there are chunks, and none for a single chunk), keeping the
+    journal as it is, into a new file that replaces the old one.
+    """
+    header = _read_vault_header(path)
+    if header.get("version", 1) < 3:
+        Vault.unlock(path, old_master).lock()  # migrates the file to the current format
+        header = _read_vault_header(path)
+    old_key = _verify_master(header, old_master)
+    kdf = kdf or header.get("kdf", KDF_DEFAULT)
+    salt = secrets.token_bytes(SALT_SIZE)
+    new_key = derive_key(new_master, salt, kdf)
+    with _file_lock(path), open(path, "rb") as f:
+        before = os.fstat(f.fileno())
+        if json.loads(f.readline())["salt"] != header["salt"]:
+            raise ValueError("Vault was re-keyed by another process; try again.")
+        lines = _iter_log_lines(f)
+        chunks = iter(lambda: list(itertools.islice(lines, REKEY_CHUNK_LINES)), [])
+        body = _rekey_stream(old_key, new_key, chunks, workers or os.cpu_count() or 1)
+        _atomic_write(path, itertools.chain([_header_line(salt, kdf, new_key)], body), expect=before)
+
+
+def change_master(path: str, old_master: str, new_master: str, workers: Optional[int] = None):
+    _rekey(path, old_master, new_master, workers=workers)
     print("Master password changed and vault re-encrypted.")
 
 
+def calibrate(path: Optional[str], name: str, target_ms: float, parallelism: int, master_password: Optional[str] = None):
+    """Benchmark ``name`` on this host and, given a vault and password, re-encrypt the vault with the result."""
+    kdf = calibrate_kdf(name, target_ms / 1000, parallelism)
+    elapsed = _time_kdf(kdf)
+    params = ", ".join(f"{k}={v}" for k, v in kdf.items() if k != "name")
+    print(f"{name}: {params} -> {elapsed * 1000:.0f} ms per unlock")
+    if path is not None and master_password is not None:
+        _rekey(path, master_password, master_password, kdf)
+        print("Vault re-encrypted with the calibrated KDF:", path)
+    return kdf
+
+
 def export_vault(path: str, master_password: str, out_path: str):
   
     if not os.path.exists(path):
         print("Vault not found:", path)
         return
    
-    _ = load_vault(path, master_password)
-    with open(path, "r", encoding="utf-8") as fin:
-        data = fin.read()
-    with open(out_path, "w", encoding="utf-8") as fout:
-        fout.write(data)
+    _verify_master(_read_vault_header(path), master_password)
+    with open(path, "rb") as fin, open(out_path, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
     print("Exported encrypted vault to", out_path)
 
 
@@ -167,26 +1282,175 @@ def import_vault(path: str, master_password: str, in_path: str):
     if not os.path.exists(in_path):
         print("File not found:", in_path)
         return
-    with open(in_path, "r", encoding="utf-8") as f:
-        payload = json.load(f)
-   
-    salt = base64.b64decode(payload["salt"])
-    token = base64.b64decode(payload["data"])
-    key = derive_key(master_password, salt)
-    fernet = Fernet(key)
     try:
-        fernet.decrypt(token)
-    except Exception:
+        _verify_master(_read_vault_header(in_path), master_password)
+    except ValueError:
         print("Given master password cannot decrypt the imported vault (wrong password?).")
         return
    
-    _write_vault_file(path, payload)
+    with _file_lock(path), open(in_path, "rb") as f:
+        _atomic_write(path, iter(lambda: f.read(1 << 16), b""))
     print("Imported vault saved to", path)
 
 
+def _agent_socket_path(vault_path: str) -> str:
+    """Socket of the agent serving ``vault_path``: $PASSWORD_MANAGER_AGENT, else one per vault in a private dir."""
+    if os.environ.get(AGENT_SOCKET_ENV):
+        return os.environ[AGENT_SOCKET_ENV]
+    base = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"password_manager-{os.getuid()}")
+    try:
+        os.mkdir(base, 0o700)
+    except FileExistsError:
+        pass
+    # The name in the shared temp dir is predictable, so someone else may have made it first.
+    st = os.lstat(base)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f"{base} is not a directory private to this user; not using it for the agent.")
+    digest = hashlib.sha256(os.path.realpath(vault_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base, f"password_manager-{digest}.sock")
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None  # no portable peer credentials here; the 0600 socket in a 0700 dir has to do
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _pid, uid, _gid = struct.unpack("3i", creds)
+    return uid
+
+
+def _agent_handle(vault: Vault, request: Dict[str, Any]) -> Dict[str, Any]:
+    if os.path.realpath(request.get("vault", "")) != os.path.realpath(vault.path):
+        return {"ok": False, "error": "agent serves a different vault"}
+    cmd = request.get("cmd")
+    try:
+        vault.refresh()
+    except ValueError as e:
+        # Re-keyed by change-master or calibrate: the cached key no longer opens the vault.
+        return {"ok": False, "error": str(e), "unlock": True}
+    if cmd == "ping":
+        return {"ok": True}
+    if cmd == "get":
+        return {"ok": True, "entry": vault.get(request["label"])}
+    if cmd == "list":
+        return {"ok": True, "labels": vault.labels()}
+    if cmd == "search":
+        results = vault.search(request["query"], request.get("limit", 10))
+        return {"ok": True, "results": [(label, vault.get(label)["username"], score) for label, score in results]}
+    if cmd == "add":
+        existed = request["label"] in vault
+        vault.set(request["label"], request["username"], request["password"], request["notes"])
+        vault.save()
+        return {"ok": True, "existed": existed}
+    return {"ok": False, "error": f"unknown agent command '{cmd}'"}
+
+
+async def _agent_serve(vault: Vault, sock_path: str, idle_timeout: float):
+    loop = asyncio.get_running_loop()
+    last_used = loop.time()
+    stop = asyncio.Event()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        nonlocal last_used
+        try:
+            if _peer_uid(writer.get_extra_info("socket")) not in (None, os.getuid()):
+                return
+            while not stop.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                last_used = loop.time()
+                try:
+                    request = json.loads(line)
+                    if request.get("cmd") == "stop":
+                        response = {"ok": True}
+                        stop.set()
+                    else:
+                        response = _agent_handle(vault, request)
+                        if response.get("unlock"):
+                            stop.set()
+                except (ValueError, KeyError, OSError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    old_umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(handle, path=sock_path)
+    finally:
+        os.umask(old_umask)
+    async with server:
+        while not stop.is_set():
+            remaining = last_used + idle_timeout - loop.time()
+            if remaining <= 0:
+                print("Agent idle, locking vault.")
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+def run_agent(path: str, master_password: str, idle_timeout: float = AGENT_IDLE_TIMEOUT):
+    """Unlock ``path`` once and answer get/list/search/add requests over a Unix socket until idle or stopped."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("The agent needs Unix domain sockets, which this platform lacks.")
+    sock_path = _agent_socket_path(path)
+    if _agent_request(path, {"cmd": "ping"}) is not None:
+        print("An agent is already running for", path)
+        return
+    if os.path.exists(sock_path):
+        os.unlink(sock_path)  # stale socket from an agent that died
+    with Vault.unlock(path, master_password, ttl=None) as vault:
+        print("Agent listening on", sock_path)
+        try:
+            asyncio.run(_agent_serve(vault, sock_path, idle_timeout))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(sock_path):
+                os.unlink(sock_path)
+    print("Agent stopped.")
+
+
+def _agent_request(vault_path: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Send ``request`` to the agent for ``vault_path``; None if no usable agent is running.
+
+    An agent whose vault was re-keyed since it unlocked it counts as none;
+    it exits after answering.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        sock_path = _agent_socket_path(vault_path)
+        if not os.path.exists(sock_path):
+            return None
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10)
+            sock.connect(sock_path)
+            if _peer_uid(sock) not in (None, os.getuid()):
+                raise ValueError(f"{sock_path} is served by another user; not sending it anything.")
+            sock.sendall(json.dumps(dict(request, vault=os.path.realpath(vault_path))).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    response = json.loads(line)
+    if response.get("unlock"):
+        return None
+    if not response.get("ok"):
+        raise ValueError(f"agent: {response.get('error')}")
+    return response
+
+
 def main():
     p = argparse.ArgumentParser(description="Simple CLI Password Manager")
     p.add_argument("--vault", default=VAULT_PATH_DEFAULT, help="path to vault file (default: vault.json)")
+    p.add_argument("--profile", action="store_true",
+                   help="write per-phase timings and byte counts to stderr as JSON lines")
 
     sub = p.add_subparsers(dest="cmd")
 
@@ -200,10 +1464,37 @@ def main():
 
     sub.add_parser("list", help="list entries")
 
+    search_p = sub.add_parser("search", help="fuzzy search labels, usernames and notes")
+    search_p.add_argument("query", help="text to look for (typos and partial words are fine)")
+    search_p.add_argument("--limit", type=int, default=10, help="maximum results (default: 10)")
+
+    audit_p = sub.add_parser("audit", help="report reused, weak and breached passwords")
+    audit_p.add_argument("--breaches", metavar="FILE",
+                         help="sorted SHA-1 breached-password list (HASH[:count] per line) to check against")
+
     del_p = sub.add_parser("delete", help="delete an entry")
     del_p.add_argument("label", help="label to delete")
 
-    sub.add_parser("change-master", help="change the master password")
+    apply_p = sub.add_parser("apply", aliases=["add-batch"],
+                             help="apply upserts/deletes from a JSONL or CSV file in one commit")
+    apply_p.add_argument("infile", help="records file, or - for stdin "
+                                        "(fields: op=upsert|delete, label, username, password, notes)")
+
+    cm_p = sub.add_parser("change-master", help="change the master password")
+    cm_p.add_argument("--workers", type=int, help="processes re-encrypting the vault (default: one per CPU)")
+
+    cal_p = sub.add_parser("calibrate", help="benchmark this host and re-encrypt the vault with KDF "
+                                             "parameters that hit a target unlock time")
+    cal_p.add_argument("--kdf", choices=KDF_NAMES, default="pbkdf2-sha256", help="key derivation function "
+                       "(scrypt and argon2id are memory-hard; default: pbkdf2-sha256)")
+    cal_p.add_argument("--target-ms", type=float, default=250, help="target unlock latency (default: 250)")
+    cal_p.add_argument("--parallelism", type=int, default=1, help="scrypt p / argon2id lanes (default: 1)")
+    cal_p.add_argument("--dry-run", action="store_true", help="only print the parameters; leave the vault alone")
+    agent_p = sub.add_parser("agent", help="unlock once and serve get/list/search/add over a local socket")
+    agent_p.add_argument("--idle-timeout", type=float, default=AGENT_IDLE_TIMEOUT,
+                         help=f"seconds without requests before the agent exits (default: {AGENT_IDLE_TIMEOUT})")
+    agent_p.add_argument("--stop", action="store_true", help="stop the running agent")
+
     exp = sub.add_parser("export", help="export encrypted vault to a file")
     exp.add_argument("out", help="output path (eg vault_export.json)")
     imp = sub.add_parser("import", help="import encrypted vault from a file")
@@ -216,6 +1507,8 @@ def main():
         sys.exit(1)
 
     vault_path = args.vault
+    if args.profile:
+        enable_profiling()
 
     try:
         if args.cmd == "init":
@@ -227,24 +1520,54 @@ def main():
             init_vault(vault_path, master)
 
         elif args.cmd == "add":
-            master = getpass.getpass("Master password: ")
+            agent = _agent_request(vault_path, {"cmd": "ping"})
+            master = None if agent else getpass.getpass("Master password: ")
             label = args.label
             username = input("Username: ")
             pw = getpass.getpass("Password (leave empty to generate random): ")
             if not pw:
                
-                pw = base64.urlsafe_b64encode(os.urandom(12)).decode("utf-8").rstrip("=")
+                pw = _generate_password()
                 print("Generated password:", pw)
             notes = input("Notes (optional): ")
-            add_entry(vault_path, master, label, username, pw, notes)
+            if agent:
+                response = _agent_request(vault_path, {"cmd": "add", "label": label, "username": username,
+                                                       "password": pw, "notes": notes})
+                if response is None:
+                    raise ValueError("agent went away; entry not saved")
+                if response["existed"]:
+                    print(f"Warning: '{label}' already existed and was overwritten.")
+                print("Saved entry:", label)
+            else:
+                add_entry(vault_path, master, label, username, pw, notes)
 
         elif args.cmd == "get":
-            master = getpass.getpass("Master password: ")
-            get_entry(vault_path, master, args.label)
+            response = _agent_request(vault_path, {"cmd": "get", "label": args.label})
+            if response is not None:
+                _print_entry(args.label, response["entry"])
+            else:
+                master = getpass.getpass("Master password: ")
+                get_entry(vault_path, master, args.label)
 
         elif args.cmd == "list":
+            response = _agent_request(vault_path, {"cmd": "list"})
+            if response is not None:
+                _print_labels(response["labels"])
+            else:
+                master = getpass.getpass("Master password: ")
+                list_entries(vault_path, master)
+
+        elif args.cmd == "search":
+            response = _agent_request(vault_path, {"cmd": "search", "query": args.query, "limit": args.limit})
+            if response is not None:
+                _print_search(response["results"])
+            else:
+                master = getpass.getpass("Master password: ")
+                search_entries(vault_path, master, args.query, args.limit)
+
+        elif args.cmd == "audit":
             master = getpass.getpass("Master password: ")
-            list_entries(vault_path, master)
+            audit_vault(vault_path, master, args.breaches)
 
         elif args.cmd == "delete":
             master = getpass.getpass("Master password: ")
@@ -254,6 +1577,14 @@ def main():
             else:
                 print("Delete cancelled.")
 
+        elif args.cmd in ("apply", "add-batch"):
+            master = getpass.getpass("Master password: ")
+            if args.infile == "-":
+                apply_batch(vault_path, master, sys.stdin)
+            else:
+                with open(args.infile, "r", encoding="utf-8", newline="") as f:
+                    apply_batch(vault_path, master, f)
+
         elif args.cmd == "change-master":
             old = getpass.getpass("Current master password: ")
             new = getpass.getpass("New master password: ")
@@ -261,7 +1592,23 @@ def main():
             if not constant_time.bytes_eq(new.encode(), confirm.encode()):
                 print("New passwords do not match. Aborting.")
                 return
-            change_master(vault_path, old, new)
+            change_master(vault_path, old, new, args.workers)
+
+        elif args.cmd == "calibrate":
+            if args.dry_run:
+                calibrate(None, args.kdf, args.target_ms, args.parallelism)
+            else:
+                master = getpass.getpass("Master password: ")
+                _verify_master(_read_vault_header(vault_path), master)
+                calibrate(vault_path, args.kdf, args.target_ms, args.parallelism, master)
+
+        elif args.cmd == "agent":
+            if args.stop:
+                if _agent_request(vault_path, {"cmd": "stop"}) is None:
+                    print("No agent running for", vault_path)
+            else:
+                master = getpass.getpass("Master password: ")
+                run_agent(vault_path, master, args.idle_timeout)
 
         elif args.cmd == "export":
             master = getpass.getpass("Master password: ")
@@ -276,6 +1623,9 @@ def main():
         print("Error:", e)
     except ValueError as e:
         print("Error:", e)
+    finally:
+        if _profiler is not None:
+            _profiler.report(sys.stderr, args.cmd)
 
 
 if __name__ == "__main__":
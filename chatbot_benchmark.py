@@ -0,0 +1,202 @@
+"""Throughput of the chatbot intent engine and load test of the chat server.
+
+Classifies a synthetic corpus of chat messages with IntentEngine and with
+the keyword-substring chain ChatBoot.py used before, and reports messages
+per second and how often the old chain fired on a keyword inside another
+word ("hi" in "this").  --load starts chatbot_server.py in a separate
+process and holds that many conversations open at once, reporting reply
+latency and throughput.  --retrieval writes a synthetic document corpus,
+times building the FAQ index over it, opening it and answering queries.
+
+    python chatbot_benchmark.py --messages 1000000
+    python chatbot_benchmark.py --load 5000 --per-client 20
+    python chatbot_benchmark.py --retrieval 2000 --queries 10000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from chatbot_engine import IntentEngine
+from chatbot_retrieval import FaqIndex, build_index
+from chatbot_server import raise_open_file_limit
+
+WORDS = ("this", "is", "what", "sometimes", "think", "which", "the", "weather", "today", "my", "code", "python",
+         "they", "history", "shipping", "anytime", "nice", "really", "you", "can", "tell", "about", "maybe")
+PHRASES = ("hello", "hi", "hey there", "how are you", "bye", "see you soon", "help me", "what can you do",
+           "what time is it", "tell me a joke", "that was funny", "check the clock")
+
+
+def legacy_intent(user_input):
+    """The elif chain from the original ChatBotGUI.get_bot_response."""
+    user_input = user_input.lower()
+    if any(word in user_input for word in ['hello', 'hi', 'hey']):
+        return "greeting"
+    elif any(word in user_input for word in ['how are you', 'how do you do']):
+        return "how_are_you"
+    elif any(word in user_input for word in ['bye', 'goodbye', 'see you']):
+        return "goodbye"
+    elif any(word in user_input for word in ['help', 'what can you do']):
+        return "help"
+    elif any(word in user_input for word in ['time', 'clock']):
+        return "time"
+    elif any(word in user_input for word in ['joke', 'funny']):
+        return "joke"
+    return None
+
+
+def synthetic_messages(count, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(2, 12))
+        if rng.random() < 0.5:
+            words.insert(rng.randint(0, len(words)), rng.choice(PHRASES))
+        message = " ".join(words)
+        yield message.capitalize() + rng.choice(("", "?", "!", "."))
+
+
+def measure(name, classify, messages):
+    start = time.perf_counter()
+    results = [classify(message) for message in messages]
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {len(messages) / elapsed:12,.0f} messages/s  ({elapsed:.2f} s)")
+    return results
+
+
+async def chat_client(port, messages, connected, start, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 16)
+    greeting = await reader.readline()
+    if not greeting.startswith(b"WELCOME"):
+        writer.close()
+        return False
+    connected.append(1)
+    # Every client holds its connection until all are open, so the server really has them all at once.
+    await start.wait()
+    for message in messages:
+        sent = time.perf_counter()
+        writer.write(message.encode("utf-8") + b"\n")
+        await writer.drain()
+        await reader.readline()
+        latencies.append((time.perf_counter() - sent) * 1000)
+    writer.write(b"/quit\n")
+    writer.close()
+    return True
+
+
+async def load_test(port, clients, per_client):
+    corpus = list(synthetic_messages(clients * per_client))
+    connected, latencies, start = [], [], asyncio.Event()
+    tasks = [asyncio.create_task(chat_client(port, corpus[i * per_client:(i + 1) * per_client],
+                                             connected, start, latencies))
+             for i in range(clients)]
+    while len(connected) < clients and not any(task.done() for task in tasks):
+        await asyncio.sleep(0.05)
+    print(f"{len(connected)} of {clients} conversations open at once")
+    started = time.perf_counter()
+    start.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failed = sum(result is not True for result in results)
+    latencies.sort()
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+    print(f"{len(latencies):,} replies in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f} replies/s), "
+          f"{failed} sessions refused or failed")
+    print(f"latency p50 {pick(0.5):.2f} ms  p99 {pick(0.99):.2f} ms  max {latencies[-1]:.2f} ms")
+
+
+def run_load_test(clients, per_client):
+    raise_open_file_limit()
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_server.py")
+    server = subprocess.Popen([sys.executable, server_script, "--port", "0", "--max-sessions", str(clients)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline().rsplit(":", 1)[1])
+        asyncio.run(load_test(port, clients, per_client))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def synthetic_documents(docs_dir, count, seed=1):
+    """Write count markdown files of about 800 words over a Zipf-like vocabulary."""
+    rng = random.Random(seed)
+    vocabulary = [f"{rng.choice(WORDS)}{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    total = 0
+    for n in range(count):
+        sections = []
+        for s in range(4):
+            paragraphs = [" ".join(rng.choices(vocabulary, weights, k=rng.randint(20, 80))) for _ in range(4)]
+            sections.append(f"## Topic {n}.{s}\n\n" + "\n\n".join(paragraphs))
+        text = f"# Document {n}\n\n" + "\n\n".join(sections) + "\n"
+        with open(os.path.join(docs_dir, f"doc{n:05}.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+        total += len(text.encode("utf-8"))
+    return vocabulary, weights, total
+
+
+def run_retrieval(documents, queries):
+    with tempfile.TemporaryDirectory() as docs_dir:
+        vocabulary, weights, size = synthetic_documents(docs_dir, documents)
+        path = os.path.join(docs_dir, "bench.idx")
+        start = time.perf_counter()
+        chunks = build_index(docs_dir, path)
+        elapsed = time.perf_counter() - start
+        print(f"build: {documents:,} documents, {size / 1e6:.1f} MB, {chunks:,} chunks in {elapsed:.2f} s "
+              f"({size / 1e6 / elapsed:.1f} MB/s, {chunks / elapsed:,.0f} chunks/s), "
+              f"index {os.path.getsize(path) / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        index = FaqIndex(path)
+        print(f"open: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        rng = random.Random(2)
+        # Mostly words from the head of the vocabulary, like real questions, with some rare ones.
+        questions = [" ".join(rng.choices(vocabulary, weights, k=rng.randint(2, 4)) +
+                              rng.choices(vocabulary, k=rng.randint(0, 1)))
+                     for _ in range(queries)]
+        latencies = []
+        started = time.perf_counter()
+        for question in questions:
+            sent = time.perf_counter()
+            index.search(question)
+            latencies.append((time.perf_counter() - sent) * 1000)
+        elapsed = time.perf_counter() - started
+        index.close()
+        latencies.sort()
+        pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+        print(f"query: {queries / elapsed:,.0f} queries/s, top-3 latency p50 {pick(0.5):.2f} ms  "
+              f"p99 {pick(0.99):.2f} ms  max {latencies[-1]:.2f} ms")
+
+
+def main():
+    p = argparse.ArgumentParser(description="chatbot intent engine throughput and server load test")
+    p.add_argument("--messages", type=int, default=1_000_000, help="corpus size (default: 1000000)")
+    p.add_argument("--load", type=int, metavar="CLIENTS", help="load-test the server with this many conversations")
+    p.add_argument("--per-client", type=int, default=20, help="messages per conversation for --load (default: 20)")
+    p.add_argument("--retrieval", type=int, metavar="DOCUMENTS", help="benchmark the FAQ index over this many documents")
+    p.add_argument("--queries", type=int, default=10000, help="queries for --retrieval (default: 10000)")
+    args = p.parse_args()
+    if args.load:
+        run_load_test(args.load, args.per_client)
+        return
+    if args.retrieval:
+        run_retrieval(args.retrieval, args.queries)
+        return
+
+    messages = list(synthetic_messages(args.messages))
+    engine = IntentEngine.from_file()
+    old = measure("legacy", legacy_intent, messages)
+    new = measure("engine", engine.classify, messages)
+    differ = sum(a != b for a, b in zip(old, new))
+    print(f"intent differs on {differ:,} of {len(messages):,} messages "
+          f"({differ / len(messages):.1%}), mostly keywords inside other words")
+
+
+if __name__ == "__main__":
+    main()
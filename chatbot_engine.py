@@ -0,0 +1,217 @@
+import collections
+import datetime
+import functools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+INTENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_intents.json")
+# How often, in seconds, an engine loaded from a file checks it for changes.
+RELOAD_CHECK = 2.0
+
+# Response providers by name; an intent with "provider" in the intents file gets its replies from one.
+PROVIDERS = {}
+
+
+def ttl_cache(ttl, clock=time.monotonic):
+    """Memoize a function for ttl seconds, separately for each set of arguments."""
+    def decorate(func):
+        lock = threading.Lock()
+        cache = {}
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            with lock:
+                cached = cache.get(args)
+                if cached and clock() - cached[0] < ttl:
+                    return cached[1]
+                value = func(*args)
+                cache[args] = (clock(), value)
+                return value
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorate
+
+
+def provider(name, ttl=None):
+    """Register a function returning a reply, or a list to pick one from, as a response provider.
+
+    It is called with the IntentEngine only when its intent is chosen, and
+    at most once every ttl seconds per engine if ttl is given.
+    """
+    def register(func):
+        PROVIDERS[name] = ttl_cache(ttl)(func) if ttl else func
+        return func
+    return register
+
+
+@provider("time")
+def time_replies(engine):
+    now = datetime.datetime.now()
+    return [f"The current time is {now:%H:%M}", f"It's {now:%I:%M %p} right now"]
+
+
+@provider("doc_topics", ttl=300)
+def doc_topics(engine):
+    index = engine.faq
+    if index is None:
+        return "I don't have any documents to answer questions from yet."
+    topics = []
+    for chunk_id in range(index.chunks):
+        source, heading, _ = index.chunk(chunk_id)
+        if (heading or source) not in topics:
+            topics.append(heading or source)
+    more = f" and {len(topics) - 12} more" if len(topics) > 12 else ""
+    return f"You can ask me about: {', '.join(topics[:12])}{more}."
+
+
+_Tables = collections.namedtuple("_Tables", "intents default priority keywords findall responses")
+
+
+class IntentEngine:
+    """Picks a reply intent for a message in one regex pass.
+
+    Every keyword of every intent is compiled into a single alternation that
+    only matches whole words, so "hi" no longer fires inside "this".  Each
+    hit scores the number of words in its keyword for that intent; the
+    highest score wins, ties going to the intent listed first.
+
+    An intent's replies are either a fixed "responses" list or the name of
+    a "provider" from PROVIDERS, called each time the intent is chosen.  An
+    engine made by from_file reloads the file when it changes; if the new
+    file is broken the old intents stay in use.
+
+    faq is the chatbot_retrieval.FaqIndex the engine answers from: messages
+    that match no intent are passed to its answer() before a default reply
+    is used, unless another fallback callable is given.
+    """
+
+    def __init__(self, intents, default, rng=None, fallback=None, path=None, faq=None):
+        self.rng = rng or random.Random()
+        self.faq = faq
+        self.fallback = fallback or (faq.answer if faq else None)
+        self.path = path
+        self._tables = self._compile(intents, default)
+        self._stamp = self._file_stamp()
+        self._next_check = time.monotonic() + RELOAD_CHECK
+
+    @staticmethod
+    def _compile(intents, default):
+        # Checked here, not when a reply is picked, so a bad reload is refused up front.
+        if not isinstance(default, list) or not default:
+            raise ValueError("The default replies must be a non-empty list")
+        priority = {intent["name"]: i for i, intent in enumerate(intents)}
+        keywords = {}
+        for intent in intents:
+            for keyword in intent["keywords"]:
+                keyword = " ".join(keyword.lower().split())
+                if keyword:
+                    keywords.setdefault(keyword, intent["name"])
+        # Keywords are grouped by their first letter, so at each position of a message the
+        # regex tries only the group starting with that letter, and the word-start check
+        # comes after that letter has matched.  Longest first within a group, so
+        # "how are you" is preferred over any keyword it starts with.
+        groups = {}
+        for keyword in sorted(keywords, key=len, reverse=True):
+            rest = r"\s+".join(map(re.escape, keyword[1:].split(" ")))
+            groups.setdefault(keyword[0], []).append(rest)
+        pattern = "|".join(rf"{re.escape(first)}(?<!\w.)(?:{'|'.join(rests)})" for first, rests in groups.items())
+        # With no keywords at all the pattern can never match.
+        findall = re.compile(rf"(?:{pattern})(?!\w)" if groups else r"(?!)").findall
+        responses = {}
+        for intent in intents:
+            if "provider" in intent:
+                if intent["provider"] not in PROVIDERS:
+                    raise ValueError(f"Intent {intent['name']!r} uses unknown provider {intent['provider']!r}")
+                responses[intent["name"]] = PROVIDERS[intent["provider"]]
+            elif isinstance(intent.get("responses"), list) and intent["responses"]:
+                responses[intent["name"]] = intent["responses"]
+            else:
+                raise ValueError(f"Intent {intent['name']!r} needs a non-empty responses list or a provider")
+        # Built whole and swapped in with one assignment, so other threads never see half a reload.
+        return _Tables(intents, default, priority, keywords, findall, responses)
+
+    @classmethod
+    def from_file(cls, path=INTENTS_FILE, rng=None, fallback=None, faq=None):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["intents"], data["default"], rng, fallback, path, faq)
+
+    @property
+    def intents(self):
+        return self._tables.intents
+
+    @property
+    def default(self):
+        return self._tables.default
+
+    def _file_stamp(self):
+        if not self.path:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload(self):
+        """Re-read the intents file if it changed; returns True if new intents were loaded."""
+        stamp = self._file_stamp()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._tables = self._compile(data["intents"], data["default"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Keeping the current intents, could not reload {self.path}: {e}", file=sys.stderr)
+            return False
+        return True
+
+    def _maybe_reload(self):
+        if self.path and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + RELOAD_CHECK
+            self.reload()
+
+    def classify(self, message):
+        """Return the best-scoring intent name for message, or None."""
+        tables = self._tables
+        found = tables.findall(message.lower())
+        if not found:
+            return None
+        if len(found) == 1:
+            # The common case: one keyword, so no scoring needed.
+            return tables.keywords.get(found[0]) or tables.keywords[" ".join(found[0].split())]
+        scores = {}
+        for keyword in found:
+            words = keyword.split()
+            intent = tables.keywords[" ".join(words)]
+            scores[intent] = scores.get(intent, 0) + len(words)
+        return min(scores, key=lambda name: (-scores[name], tables.priority[name]))
+
+    def reply(self, intent, rng=None):
+        """A reply for an intent from classify (None for the default replies)."""
+        tables = self._tables
+        # An intent removed by a reload since it was classified gets a default reply.
+        replies = tables.responses.get(intent, tables.default) if intent else tables.default
+        if callable(replies):
+            replies = replies(self)
+        return replies if isinstance(replies, str) else (rng or self.rng).choice(replies)
+
+    def answer(self, message, rng=None):
+        """(intent, reply) for message; the intent is "faq" when the fallback answered."""
+        self._maybe_reload()
+        intent = self.classify(message)
+        if intent is None and self.fallback:
+            reply = self.fallback(message)
+            if reply:
+                return "faq", reply
+        return intent, self.reply(intent, rng)
+
+    def respond(self, message, rng=None):
+        return self.answer(message, rng)[1]
@@ -0,0 +1,312 @@
+"""Offline FAQ answers for the chatbot from local markdown and text files.
+
+Every .md and .txt file under the docs directory is split into chunks of
+about CHUNK_WORDS words, each remembering the heading it sits under.  The
+chunks are indexed for BM25 into one binary file that is written once and
+then memory-mapped, so opening it reads nothing up front and a query only
+touches the postings of its own terms.  Each posting stores its BM25 term
+weight, and every term's postings are sorted best first, so a query reads at
+most MAX_POSTINGS per term: for a word found nearly everywhere only the
+chunks where it weighs most are scored.  The index is rebuilt when a
+document is added, removed or changed.
+
+    python chatbot_retrieval.py "how do I start the server"
+"""
+
+import argparse
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from collections import Counter, defaultdict
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chatbot_docs")
+INDEX_NAME = ".faq_index"
+DOC_EXTENSIONS = (".md", ".txt")
+CHUNK_WORDS = 120
+TOP_K = 3
+MAX_POSTINGS = 1000
+# BM25 parameters, and how good the best chunk must be before it is used as a reply.
+K1 = 1.2
+B = 0.75
+MIN_SCORE = 2.0
+MIN_COVERAGE = 0.5
+ANSWER_CHARS = 400
+
+MAGIC = b"CBFAQ\x00\x00\x01"
+# magic, little-endian flag, chunks, terms, postings, average chunk length, document signature
+HEADER = struct.Struct("<8sIIIId32s")
+STOPWORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have how i if in into is it its
+me my of on or our so that the their them then there these they this to was we were what when where
+which who why will with would you your
+""".split())
+
+
+def tokenize(text):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+
+
+def list_documents(docs_dir):
+    """Paths of the indexable documents under docs_dir, relative and sorted."""
+    found = []
+    for root, dirs, files in os.walk(docs_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in files:
+            if name.lower().endswith(DOC_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, name), docs_dir))
+    return sorted(found)
+
+
+def docs_signature(docs_dir, sources):
+    digest = hashlib.sha256(MAGIC + str((CHUNK_WORDS, K1, B)).encode())
+    for source in sources:
+        st = os.stat(os.path.join(docs_dir, source))
+        digest.update(f"{source}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.digest()
+
+
+def chunk_document(text, chunk_words=CHUNK_WORDS):
+    """Yield (heading, body) chunks of at most about chunk_words words."""
+    heading, parts, size = "", [], 0
+    for block in re.split(r"\n\s*\n", text):
+        lines = block.strip().splitlines()
+        while lines and lines[0].startswith("#"):
+            if parts:
+                yield heading, "\n\n".join(parts)
+                parts, size = [], 0
+            heading = lines.pop(0).lstrip("#").strip()
+        if not lines:
+            continue
+        paragraph = "\n".join(lines)
+        words = paragraph.split()
+        if parts and size + len(words) > chunk_words:
+            yield heading, "\n\n".join(parts)
+            parts, size = [], 0
+        if len(words) > chunk_words:
+            # A paragraph too long for one chunk is cut into word windows.
+            for i in range(0, len(words), chunk_words):
+                yield heading, " ".join(words[i:i + chunk_words])
+            continue
+        parts.append(paragraph)
+        size += len(words)
+    if parts:
+        yield heading, "\n\n".join(parts)
+
+
+def _padded(size):
+    # Sections start on 8-byte boundaries so the arrays can be cast in place.
+    return size + -size % 8
+
+
+def _aligned(data):
+    return data + bytes(_padded(len(data)) - len(data))
+
+
+def build_index(docs_dir, path, sources=None):
+    """Chunk and index every document under docs_dir into path; returns the chunk count."""
+    sources = list_documents(docs_dir) if sources is None else sources
+    signature = docs_signature(docs_dir, sources)
+    postings = defaultdict(list)
+    lengths, text_offsets, text = array("I"), array("I", [0]), bytearray()
+    for source in sources:
+        with open(os.path.join(docs_dir, source), "r", encoding="utf-8", errors="replace") as f:
+            document = f.read()
+        for heading, body in chunk_document(document):
+            chunk_id = len(lengths)
+            counts = Counter(tokenize(heading + "\n" + body))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term].append((chunk_id, tf))
+            text += f"{source}\0{heading}\0{body}".encode("utf-8")
+            text_offsets.append(len(text))
+
+    avgdl = max(sum(lengths), 1) / max(len(lengths), 1)
+    norms = [K1 * (1 - B + B * length / avgdl) for length in lengths]
+    terms = sorted(term.encode("utf-8") for term in postings)
+    term_offsets, term_starts = array("I", [0]), array("I", [0])
+    post_chunks, post_weights = array("I"), array("f")
+    for term in terms:
+        # The BM25 weight of the term in each chunk, without the idf; best first.
+        weighted = sorted(((tf * (K1 + 1) / (tf + norms[chunk_id]), chunk_id)
+                           for chunk_id, tf in postings[term.decode("utf-8")]), reverse=True)
+        for weight, chunk_id in weighted:
+            post_chunks.append(chunk_id)
+            post_weights.append(weight)
+        term_offsets.append(term_offsets[-1] + len(term))
+        term_starts.append(len(post_chunks))
+
+    header = HEADER.pack(MAGIC, sys.byteorder == "little", len(lengths), len(terms), len(post_chunks),
+                         avgdl, signature)
+    # A private temporary file, so two processes rebuilding at once never write into each other's.
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_aligned(header))
+            for section in (term_offsets, term_starts, post_chunks, post_weights, text_offsets):
+                f.write(_aligned(section.tobytes()))
+            f.write(_aligned(b"".join(terms)))
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return len(lengths)
+
+
+class FaqIndex:
+    """BM25 search over a memory-mapped index written by build_index."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except (ValueError, struct.error, TypeError):
+            raise ValueError(f"{path} is not a usable FAQ index") from None
+
+    def _load(self):
+        magic, little, self.chunks, self.terms, n_postings, self.avgdl, self.signature = \
+            HEADER.unpack_from(self._mm)
+        # Arrays are stored in the byte order of the machine that built them.
+        if (magic != MAGIC or bool(little) != (sys.byteorder == "little")
+                or array("I").itemsize != 4 or array("f").itemsize != 4):
+            raise ValueError
+        view = memoryview(self._mm)
+        pos = _padded(HEADER.size)
+
+        def section(count, typecode="I"):
+            nonlocal pos
+            data = view[pos:pos + 4 * count].cast(typecode)
+            if len(data) != count:
+                raise ValueError
+            pos += _padded(4 * count)
+            return data
+
+        self._term_offsets = section(self.terms + 1)
+        self._term_starts = section(self.terms + 1)
+        self._post_chunks = section(n_postings)
+        self._post_weights = section(n_postings, "f")
+        self._text_offsets = section(self.chunks + 1)
+        self._term_base = pos
+        self._text_base = pos + _padded(self._term_offsets[-1])
+
+    @classmethod
+    def open(cls, docs_dir=DOCS_DIR, path=None):
+        """The index for docs_dir, rebuilt first if the documents changed.
+
+        None without documents, or if the index can neither be read nor rebuilt
+        (say the directory is read-only), so the chatbot just runs without FAQ answers.
+        """
+        if not os.path.isdir(docs_dir):
+            return None
+        sources = list_documents(docs_dir)
+        if not sources:
+            return None
+        path = path or os.path.join(docs_dir, INDEX_NAME)
+        try:
+            index = cls(path)
+            if index.signature == docs_signature(docs_dir, sources):
+                return index
+            index.close()
+        except (OSError, ValueError):
+            pass
+        try:
+            build_index(docs_dir, path, sources)
+            return cls(path)
+        except (OSError, ValueError) as e:
+            print(f"Answering without the FAQ documents, could not index {docs_dir}: {e}", file=sys.stderr)
+            return None
+
+    def _term(self, i):
+        start = self._term_base + self._term_offsets[i]
+        return self._mm[start:self._term_base + self._term_offsets[i + 1]]
+
+    def _find(self, term):
+        # Binary search of the sorted term table, straight from the mapping.
+        lo, hi = 0, self.terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.terms and self._term(lo) == term else -1
+
+    def search(self, query, k=TOP_K):
+        """Top k (score, chunk id, fraction of query terms matched) for query, best first."""
+        terms = set(tokenize(query))
+        scores, hits = {}, {}
+        for term in terms:
+            i = self._find(term.encode("utf-8"))
+            if i < 0:
+                continue
+            start, end = self._term_starts[i], self._term_starts[i + 1]
+            idf = math.log(1 + (self.chunks - (end - start) + 0.5) / (end - start + 0.5))
+            end = min(end, start + MAX_POSTINGS)
+            for chunk_id, weight in zip(self._post_chunks[start:end], self._post_weights[start:end]):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * weight
+                hits[chunk_id] = hits.get(chunk_id, 0) + 1
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, chunk_id, hits[chunk_id] / len(terms)) for chunk_id, score in best]
+
+    def chunk(self, chunk_id):
+        """(source, heading, body) of a chunk."""
+        start = self._text_base + self._text_offsets[chunk_id]
+        end = self._text_base + self._text_offsets[chunk_id + 1]
+        source, heading, body = self._mm[start:end].decode("utf-8").split("\0", 2)
+        return source, heading, body
+
+    def answer(self, message):
+        """The best matching passage as a reply, or None if nothing matches well enough."""
+        results = self.search(message, 1)
+        if not results:
+            return None
+        score, chunk_id, coverage = results[0]
+        if score < MIN_SCORE or coverage < MIN_COVERAGE:
+            return None
+        source, heading, body = self.chunk(chunk_id)
+        body = "\n\n".join(" ".join(paragraph.split()) for paragraph in body.split("\n\n"))
+        if len(body) > ANSWER_CHARS:
+            body = body[:ANSWER_CHARS].rsplit(None, 1)[0] + "..."
+        return f"{body}\n(from {source}{': ' + heading if heading else ''})"
+
+    def close(self):
+        for name in ("_term_offsets", "_term_starts", "_post_chunks", "_post_weights", "_text_offsets"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Search the chatbot's FAQ documents")
+    p.add_argument("query", help="question to look up")
+    p.add_argument("--docs", default=DOCS_DIR, help=f"documents directory (default: {DOCS_DIR})")
+    p.add_argument("-k", type=int, default=TOP_K, help=f"number of results (default: {TOP_K})")
+    args = p.parse_args()
+
+    index = FaqIndex.open(args.docs)
+    if index is None:
+        print(f"No .md or .txt documents under {args.docs}")
+        return 1
+    for score, chunk_id, coverage in index.search(args.query, args.k):
+        source, heading, body = index.chunk(chunk_id)
+        print(f"{score:6.2f}  {source}{': ' + heading if heading else ''}  ({coverage:.0%} of terms)")
+        print("        " + " ".join(body.split())[:160])
+    print(f"\nReply: {index.answer(args.query) or '(falls back to the default replies)'}")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""Headless chat server for the chatbot engine.
+
+One asyncio process serves many conversations over a line-based TCP
+protocol.  On connect the server sends "WELCOME <session id>", or "BUSY"
+if it already has max_sessions open.  After that, each line the client
+sends gets one reply line.  "/stats" describes the session and "/quit"
+ends it.  Lines longer than MAX_LINE bytes end the session with an ERROR
+line.
+
+    python chatbot_server.py --port 8765
+    python ChatBoot.py --server 127.0.0.1:8765
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import socket
+import time
+
+from chatbot_engine import IntentEngine
+from chatbot_retrieval import DOCS_DIR, FaqIndex
+
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_LINE = 4096
+MAX_SESSIONS = 10000
+IDLE_TIMEOUT = 300
+
+
+def raise_open_file_limit():
+    """Let this process hold as many sockets as the hard limit allows."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.started = time.time()
+        self.messages = 0
+        self.last_intent = None
+        self.rng = random.Random()
+
+
+class ChatServer:
+    def __init__(self, engine, max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT):
+        self.engine = engine
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self._ids = itertools.count(1)
+
+    def reply(self, session, message):
+        if message == "/stats":
+            return (f"session {session.id}: {session.messages} messages, last intent "
+                    f"{session.last_intent or '-'}, {len(self.sessions)} sessions open")
+        session.messages += 1
+        session.last_intent, reply = self.engine.answer(message, session.rng)
+        return reply
+
+    async def handle(self, reader, writer):
+        if len(self.sessions) >= self.max_sessions:
+            # Shed load rather than queue more conversations than we can serve.
+            writer.write(b"BUSY\n")
+            writer.close()
+            return
+        session = Session(next(self._ids))
+        self.sessions[session.id] = session
+        try:
+            writer.write(f"WELCOME {session.id}\n".encode("utf-8"))
+            while True:
+                # Waiting here until the client has read earlier replies is the back-pressure:
+                # a client that stops reading stops being read from.
+                await writer.drain()
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:  # longer than the stream limit
+                    writer.write(b"ERROR line too long\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                message = line.decode("utf-8", "replace").strip()
+                if message == "/quit":
+                    break
+                reply = self.reply(session, message)
+                writer.write(" ".join(reply.splitlines()).encode("utf-8") + b"\n")
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[session.id]
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        """Serve until cancelled; ready(port) is called once listening."""
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE, backlog=4096)
+        async with server:
+            if ready:
+                ready(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+
+
+class ChatClient:
+    """Blocking client for the server.
+
+    respond() works like IntentEngine.respond, so the Tk app can use
+    either one.
+    """
+
+    def __init__(self, host=HOST, port=PORT, timeout=10):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.file = self.sock.makefile("rwb")
+        greeting = self._read_line()
+        if not greeting.startswith("WELCOME "):
+            self.close()
+            raise ConnectionError(f"Chat server refused the session: {greeting}")
+        self.session_id = int(greeting.split()[1])
+
+    def _read_line(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Chat server closed the connection")
+        return line.decode("utf-8").rstrip("\n")
+
+    def respond(self, message):
+        self.file.write(" ".join(message.splitlines()).encode("utf-8") + b"\n")
+        self.file.flush()
+        return self._read_line()
+
+    def close(self):
+        try:
+            self.file.write(b"/quit\n")
+            self.file.flush()
+        except OSError:
+            pass
+        self.file.close()
+        self.sock.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Serve the chatbot over a line-based TCP protocol")
+    p.add_argument("--host", default=HOST, help=f"address to listen on (default: {HOST})")
+    p.add_argument("--port", type=int, default=PORT, help=f"port to listen on, 0 for any free port (default: {PORT})")
+    p.add_argument("--max-sessions", type=int, default=MAX_SESSIONS,
+                   help=f"concurrent conversations before new ones get BUSY (default: {MAX_SESSIONS})")
+    p.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                   help=f"seconds before a silent session is closed (default: {IDLE_TIMEOUT})")
+    p.add_argument("--docs", default=DOCS_DIR, help=f"documents to answer questions from (default: {DOCS_DIR})")
+    args = p.parse_args()
+
+    raise_open_file_limit()
+    faq = FaqIndex.open(args.docs)
+    engine = IntentEngine.from_file(faq=faq)
+    server = ChatServer(engine, args.max_sessions, args.idle_timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port,
+                                 ready=lambda port: print(f"Listening on {args.host}:{port}", flush=True)))
+    except KeyboardInterrupt:
+        print("Server stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Benchmarks for notes_app.
+
+By default compares the original linear scan (parse notes.json, substring
+match every note) with the SQLite store's full-text index on synthetic
+corpora of several sizes, reporting build time and per-query latency.
+--blobs measures the compressed blob store on a corpus of templates and
+pasted logs: size on disk, compression ratio and load/read times.
+--history edits one note many times and reports revision storage against
+full copies, and the time to save a revision and rebuild old ones.
+
+    python benchmark.py --sizes 1000,10000,100000
+    python benchmark.py --blobs 20000
+    python benchmark.py --history 5000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import notes_app
+
+SYLLABLES = ("ba", "ko", "ri", "tan", "mel", "sus", "dor", "vi", "ple", "gra", "nox", "qua", "zen", "fi",
+             "lo", "mar", "tek", "ul", "wy", "hex", "jo", "cru", "sta", "pin")
+
+
+def synthetic_notes(count, seed=1):
+    """Yield (title, content) pairs with a Zipf-like word distribution."""
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(20000)]
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    for i in range(count):
+        words = rng.choices(vocabulary, weights, k=rng.randint(20, 120))
+        yield f"{' '.join(words[:3])} {i}", " ".join(words)
+
+
+TEMPLATES = (
+    "Meeting notes\nDate: {date}\nAttendees: {names}\nAgenda:\n1. Status updates\n2. Blockers\n"
+    "3. Next steps\nAction items:\n- {word} to follow up with {name}\n",
+    "Daily standup\nYesterday: worked on {word}\nToday: continue {word}, review PRs\nBlockers: none\n",
+    "Recipe: {word}\nIngredients:\n- 2 cups flour\n- 1 tsp salt\n- 200 ml water\n"
+    "Method: mix, rest for 30 minutes, bake at 220C for 25 minutes.\n",
+)
+LOG_LINES = ("INFO worker started job {n}", "INFO connected to database primary", "DEBUG cache hit ratio 0.{n}",
+             "WARN slow query took {n} ms", "ERROR connection reset by peer, retrying", "INFO job {n} finished")
+
+
+def blob_notes(count, seed=2):
+    """Yield (title, content) pairs: filled-in templates, log pastes and exact duplicates."""
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(500)]
+    made = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.1 and made:
+            content = rng.choice(made)
+        elif kind < 0.6:
+            content = rng.choice(TEMPLATES).format(date=f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                                                   names=", ".join(rng.sample(words, 3)), word=rng.choice(words),
+                                                   name=rng.choice(words))
+        else:
+            content = "\n".join(f"2024-05-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}:"
+                                f"{rng.randint(0, 59):02d} {rng.choice(LOG_LINES).format(n=rng.randint(1, 999))}"
+                                for _ in range(rng.randint(10, 80)))
+        made.append(content)
+        yield f"note {i}", content
+
+
+def bench_blobs(tmp, count):
+    notes = list(blob_notes(count))
+    json_path = os.path.join(tmp, "blobs.json")
+    notes_app.save_notes([{"title": title, "content": content} for title, content in notes], json_path)
+    db_path = os.path.join(tmp, "blobs.db")
+    start = time.perf_counter()
+    store = notes_app.SqliteNoteStore(db_path, migrate_from=json_path)
+    print(f"{count} notes imported into the blob store in {time.perf_counter() - start:.2f} s")
+    stats = store.stats()
+    print(f"content {stats['content_bytes']:,} bytes in {stats['unique_contents']} unique contents, "
+          f"codec {stats['codec']}")
+    print(f"notes.json {os.path.getsize(json_path):,} bytes; blobs + dictionary {stats['stored_bytes']:,} bytes "
+          f"(ratio {stats['ratio']:.2f}x)")
+    load_ms, _ = timed(lambda: list(notes_app.iter_notes_file(json_path)), 3)
+    print(f"load all: notes.json {load_ms:.1f} ms, blob store {stats['load_seconds'] * 1000:.1f} ms")
+    titles_ms, _ = timed(lambda: list(store.iter_titles()), 3)
+    ids = [note_id for note_id, _ in store.iter_titles()]
+    rng = random.Random(0)
+    read_ms, _ = timed(lambda: store.get_by_id(rng.choice(ids)), 1000)
+    print(f"list titles {titles_ms:.1f} ms; read one note {read_ms * 1000:.1f} us")
+    store.close()
+
+
+def bench_history(tmp, revisions):
+    rng = random.Random(3)
+    words = ["".join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(300)]
+    line = lambda: " ".join(rng.choices(words, k=rng.randint(4, 12))) + "\n"
+    store = notes_app.SqliteNoteStore(os.path.join(tmp, "history.db"), migrate_from=None)
+    lines = [line() for _ in range(200)]
+    note_id = store.add("document", "".join(lines))
+    full_bytes = len("".join(lines).encode("utf-8"))
+    save_ms = []
+    for _ in range(revisions - 1):
+        # A typical edit: change, insert or delete a line or two.
+        for _ in range(rng.randint(1, 2)):
+            op = rng.random()
+            if op < 0.5:
+                lines[rng.randrange(len(lines))] = line()
+            elif op < 0.8 or len(lines) < 50:
+                lines.insert(rng.randint(0, len(lines)), line())
+            else:
+                del lines[rng.randrange(len(lines))]
+        content = "".join(lines)
+        full_bytes += len(content.encode("utf-8"))
+        start = time.perf_counter()
+        store.update_by_id(note_id, content)
+        save_ms.append((time.perf_counter() - start) * 1000)
+    stored = store.stored_bytes()
+    print(f"{revisions} revisions of a ~{len(content) // 1024} KiB note: full copies {full_bytes:,} bytes, "
+          f"stored {stored:,} bytes ({full_bytes / stored:.1f}x smaller, snapshot every "
+          f"{notes_app.SNAPSHOT_EVERY})")
+    print(f"save revision: p50 {statistics.median(save_ms):.2f} ms")
+    rebuild_ms = sorted(timed(lambda: store.get_revision(note_id, rng.randint(1, revisions)), 1)[0]
+                        for _ in range(500))
+    print(f"rebuild a random revision: p50 {statistics.median(rebuild_ms):.2f} ms  "
+          f"p99 {rebuild_ms[int(len(rebuild_ms) * 0.99) - 1]:.2f} ms  max {rebuild_ms[-1]:.2f} ms")
+    store.close()
+
+
+def timed(fn, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def bench(tmp, size, rounds):
+    notes = list(synthetic_notes(size))
+    json_path = os.path.join(tmp, f"notes-{size}.json")
+    notes_app.save_notes([{"title": title, "content": content} for title, content in notes], json_path)
+    json_store = notes_app.JsonNoteStore(json_path)
+
+    start = time.perf_counter()
+    store = notes_app.SqliteNoteStore(os.path.join(tmp, f"notes-{size}.db"), migrate_from=json_path)
+    print(f"{size:>7} notes: index built in {time.perf_counter() - start:.2f} s")
+
+    _, content = notes[size // 2]
+    words = content.split()
+    queries = {
+        "rare word": min(words, key=lambda w: store.index._df([w]).get(w, 0)),
+        "common word": words[0],
+        "two words": f"{words[0]} {words[-1]}",
+        "phrase": f'"{words[1]} {words[2]}"',
+        "prefix": words[-1][:4] + "*",
+    }
+    for name, query in queries.items():
+        scan_ms, _ = timed(lambda: json_store.search(query.strip('"*').split()[0]), max(1, rounds // 10))
+        index_ms, hits = timed(lambda: store.search(query), rounds)
+        print(f"{'':>7} {name:>12} {query!r:>24}: scan {scan_ms:9.2f} ms  index {index_ms:8.3f} ms  "
+              f"({len(hits)} shown)")
+    store.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description="notes_app search benchmark")
+    p.add_argument("--sizes", default="1000,10000,50000",
+                   help="comma-separated corpus sizes (default: 1000,10000,50000)")
+    p.add_argument("--rounds", type=int, default=50, help="queries per measurement (default: 50)")
+    p.add_argument("--blobs", type=int, metavar="N", help="measure the compressed blob store on N notes")
+    p.add_argument("--history", type=int, metavar="N", help="measure revision history on a note edited N times")
+    args = p.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.blobs:
+            bench_blobs(tmp, args.blobs)
+        if args.history:
+            bench_history(tmp, args.history)
+        if args.blobs or args.history:
+            return
+        for size in args.sizes.split(","):
+            bench(tmp, int(size), args.rounds)
+
+
+if __name__ == "__main__":
+    main()
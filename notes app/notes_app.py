@@ -1,99 +1,1451 @@
+import abc
+import argparse
+import codecs
+import collections
+import contextlib
+import csv
+import datetime
+import difflib
+import hashlib
+import heapq
+import itertools
 import json
+import math
 import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, so only one process should write at a time.
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:  # optional: note content is compressed with zlib instead
+    zstandard = None
 
 NOTES_FILE = "notes.json"
+NOTES_DB = "notes.db"
+# "sqlite" (default) keeps notes in NOTES_DB; "json" keeps the original
+# single-file NOTES_FILE format.
+NOTES_STORAGE = os.environ.get("NOTES_STORAGE", "sqlite")
+# Notes written per transaction by add_many / import.
+BULK_BATCH = 1000
+# Shared compression dictionary: at most DICT_SIZE bytes (zlib's window),
+# trained from up to DICT_SAMPLES notes once at least DICT_MIN_SAMPLES exist.
+DICT_SIZE = 32 * 1024
+DICT_SAMPLES = 1000
+DICT_MIN_SAMPLES = 64
+ZSTD_LEVEL = 9
+# Revision history stores every SNAPSHOT_EVERY-th revision whole and deltas in between.
+SNAPSHOT_EVERY = 32
+
+
+# Notes files are read and written in pieces of this size, so memory use
+# does not grow with the file.
+READ_CHUNK = 1 << 16
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_SEPARATOR = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class _ArrayReader:
+    """Incremental parser for a file holding one JSON array.
+
+    Text is decoded chunk by chunk and each element is parsed with
+    raw_decode as soon as it is complete, so only the current element and
+    one chunk are held in memory.  offset tracks the byte position of the
+    next unread character, which lets callers seek straight back to a note.
+    """
+
+    def __init__(self, f, path):
+        self.f = f
+        self.path = path
+        self.buf = ""
+        self.pos = 0
+        self.offset = f.tell()
+        self.eof = False
+        self.ascii = True
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+
+    def _more(self, size=READ_CHUNK):
+        data = self.f.read(size)
+        self.eof = not data
+        self.buf = self.buf[self.pos:] + self._decode(data, final=self.eof)
+        self.pos = 0
+        # With ASCII-only text, characters and bytes line up and offsets need no encoding.
+        self.ascii = self.buf.isascii()
+        return not self.eof
+
+    def _advance(self, end):
+        self.offset += end - self.pos if self.ascii else len(self.buf[self.pos:end].encode("utf-8"))
+        self.pos = end
+
+    def _peek(self):
+        while True:
+            self._advance(_WHITESPACE.match(self.buf, self.pos).end())
+            if self.pos < len(self.buf) or not self._more():
+                return self.buf[self.pos:self.pos + 1]
+
+    def _error(self, expected):
+        return ValueError(f"{self.path}: invalid notes file, expected {expected} at byte {self.offset}")
+
+    def value(self):
+        """Parse the next value; return (byte offset, value)."""
+        if self.pos >= len(self.buf) or self.buf[self.pos] in " \t\n\r":
+            self._peek()
+        size = READ_CHUNK
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value that runs to the end of the buffer may continue in the next chunk.
+            if end is not None and (end < len(self.buf) or self.eof):
+                start = self.offset
+                self._advance(end)
+                return start, value
+            if self.eof:
+                raise self._error("a JSON value")
+            self._more(size)
+            size *= 2
+
+    def __iter__(self):
+        first = self._peek()
+        if not first:
+            return
+        if first != "[":
+            raise self._error("'['")
+        self._advance(self.pos + 1)
+        if self._peek() == "]":
+            return
+        while True:
+            yield self.value()
+            match = _SEPARATOR.match(self.buf, self.pos)
+            if match and match.end() < len(self.buf):
+                separator = match.group(1)
+                self._advance(match.end())
+            else:
+                separator = self._peek()
+                if separator not in (",", "]"):
+                    raise self._error("',' or ']'")
+                self._advance(self.pos + 1)
+            if separator == "]":
+                return
+
+
+def iter_notes_file(path=NOTES_FILE):
+    """Yield (byte offset, note) for each note in a notes file, parsing it incrementally."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        yield from _ArrayReader(f, path)
+
+
+def file_version(path):
+    """What identifies one saved state of a notes file, or None if there is no file.
+
+    Saves replace the file, so the inode changes even when size and mtime
+    happen to match.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Hold an exclusive advisory lock for writing the notes file at path.
+
+    The lock is taken on a separate path + ".lock" file because saving
+    replaces the notes file itself.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Notes files up to this size stay parsed in memory between reads while
+# file_version is unchanged; bigger ones are streamed every time.
+LOAD_CACHE_BYTES = 64 * 1024 * 1024
+_load_cache = {}
+
+
+def _cached_notes(path):
+    """The parsed notes of path, reused while file_version is unchanged; None if the file is too big to keep."""
+    version = file_version(path)
+    if version is None or version[1] > LOAD_CACHE_BYTES:
+        _load_cache.pop(path, None)
+        return [] if version is None else None
+    cached = _load_cache.get(path)
+    if cached is None or cached[0] != version:
+        cached = _load_cache[path] = (version, [note for _, note in iter_notes_file(path)])
+    return cached[1]
+
+
+def load_notes(path=NOTES_FILE):
+    """Load notes from file.
+
+    Files up to LOAD_CACHE_BYTES are parsed once and reused until
+    file_version changes; callers get their own copies of the note dicts.
+    """
+    notes = _cached_notes(path)
+    if notes is None:
+        return [note for _, note in iter_notes_file(path)]
+    return [dict(note) for note in notes]
+
+
+def save_notes(notes, path=NOTES_FILE, on_write=None):
+    """Save notes to file.
+
+    notes may be any iterable; it is written one note at a time to a temp
+    file that then atomically replaces path.  on_write(offset, note) is
+    called with the byte offset of each note as it is written.  The layout
+    matches json.dump(notes, f, indent=2).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".notes-", dir=directory)
+    try:
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"[")
+            offset, separator = 1, b"\n  "
+            for note in notes:
+                f.write(separator)
+                offset += len(separator)
+                if on_write:
+                    on_write(offset, note)
+                data = json.dumps(note, indent=2).replace("\n", "\n  ").encode("utf-8")
+                f.write(data)
+                offset += len(data)
+                separator = b",\n  "
+            f.write(b"]" if separator == b"\n  " else b"\n]")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class ConflictError(ValueError):
+    """A note changed in another process between reading and writing it."""
+
+
+def title_key(title):
+    """The key titles are matched on: case-insensitive, including non-ASCII case."""
+    return title.casefold()
+
+
+class NoteStore(abc.ABC):
+    """Storage interface used by the menu functions.
+
+    Notes are dicts with a stable "id", a "title" and "content".  Titles
+    match case-insensitively (title_key) and need not be unique; find looks
+    a title up without scanning the other notes, so reading, updating and
+    deleting a note never does either.
+    """
+
+    @abc.abstractmethod
+    def find(self, title):
+        """Return the ids of the notes with this title, oldest first."""
+
+    @abc.abstractmethod
+    def add(self, title, content):
+        """Store a new note and return its id."""
+
+    def add_many(self, notes):
+        """Store (title, content) pairs from any iterable and return how many were added."""
+        count = 0
+        for title, content in notes:
+            self.add(title, content)
+            count += 1
+        return count
+
+    @abc.abstractmethod
+    def iter_notes(self):
+        """Yield every note in insertion order."""
+
+    def iter_titles(self):
+        """Yield (id, title) for every note, without reading content where the store can avoid it."""
+        for note in self.iter_notes():
+            yield note["id"], note["title"]
+
+    @abc.abstractmethod
+    def get_by_id(self, note_id):
+        """Return the note with this id, or None."""
+
+    @abc.abstractmethod
+    def update_by_id(self, note_id, content, expected=None):
+        """Replace a note's content; False if there is no such note.
+
+        expected is the content the caller last read: if the note no longer
+        has it, ConflictError is raised and nothing is written.
+        """
+
+    @abc.abstractmethod
+    def delete_by_id(self, note_id):
+        """Delete a note; False if there is no such note."""
+
+    def get(self, title):
+        """Return the first note with this title, or None."""
+        ids = self.find(title)
+        return self.get_by_id(ids[0]) if ids else None
+
+    def update(self, title, content):
+        """Replace the content of the first note with this title; False if there is none."""
+        ids = self.find(title)
+        return bool(ids) and self.update_by_id(ids[0], content)
+
+    def delete(self, title):
+        """Delete every note with this title and return how many there were."""
+        return sum(self.delete_by_id(note_id) for note_id in self.find(title))
+
+    def search(self, keyword, limit=None):
+        """Return the notes whose title or content contains keyword."""
+        keyword = keyword.lower()
+        found = (note for note in self.iter_notes()
+                 if keyword in note["title"].lower() or keyword in note["content"].lower())
+        return list(itertools.islice(found, limit))
+
+    def history(self, note_id):
+        """[(rev, created timestamp or None, size in bytes)] for a note, oldest first."""
+        raise ValueError("Revision history is only kept by the sqlite storage")
+
+    def get_revision(self, note_id, rev):
+        raise ValueError("Revision history is only kept by the sqlite storage")
+
+    def restore(self, note_id, rev):
+        """Make an old revision the note's content again, as a new revision; False if there is no such revision."""
+        content = self.get_revision(note_id, rev)
+        return content is not None and self.update_by_id(note_id, content)
+
+    @abc.abstractmethod
+    def stored_bytes(self):
+        """Bytes the notes take up on disk."""
+
+    def stats(self):
+        """Size and load-time figures: content size against bytes on disk, and the time to read every note."""
+        started = time.perf_counter()
+        notes = content_bytes = 0
+        for note in self.iter_notes():
+            notes += 1
+            content_bytes += len(note["content"].encode("utf-8"))
+        load_seconds = time.perf_counter() - started
+        stored = self.stored_bytes()
+        return {"notes": notes, "content_bytes": content_bytes, "stored_bytes": stored,
+                "ratio": content_bytes / stored if stored else 0.0, "load_seconds": load_seconds}
+
+    def close(self):
+        pass
+
+
+class JsonNoteStore(NoteStore):
+    """The original format: one JSON array, streamed rather than loaded whole.
+
+    Only each note's title and byte offset, plus a title_key -> [ids] map,
+    are kept in memory, so listing titles reads nothing and get_by_id seeks
+    to one note and parses just that.  The index is rebuilt only when
+    file_version shows another process has saved, and full reads (search)
+    go through the same version-keyed cache as load_notes.  Every change
+    takes the file lock, then streams the notes through to a new file that
+    replaces the old one.  Notes written before ids existed are numbered in
+    file order.
+    """
+
+    def __init__(self, path=NOTES_FILE):
+        self.path = path
+        self._titles = {}
+        self._offsets = {}
+        self._names = {}
+        self._next_id = 1
+        self._version = ()
+        self._refresh()
+
+    def _refresh(self):
+        version = file_version(self.path)
+        if version == self._version:
+            return
+        self._titles, self._offsets, self._names = {}, {}, {}
+        for offset, note in self._iter_file():
+            self._record(offset, note)
+        self._version = version
+
+    def _record(self, offset, note):
+        self._offsets[note["id"]] = offset
+        self._names[note["id"]] = note["title"]
+        self._titles.setdefault(title_key(note["title"]), []).append(note["id"])
+
+    def _iter_file(self):
+        return self._numbered(iter_notes_file(self.path))
+
+    def _numbered(self, entries):
+        next_id = 1
+        for offset, note in entries:
+            note.setdefault("id", next_id)
+            next_id = max(next_id, note["id"] + 1)
+            self._next_id = max(self._next_id, next_id)
+            yield offset, note
+
+    def _rewrite(self, edit=None, extra=()):
+        """Stream every note through edit (None drops it) plus extra notes into a new file.
+
+        Call with the lock held and the index refreshed.
+        """
+        def notes():
+            for _, note in self._iter_file():
+                note = edit(note) if edit else note
+                if note is not None:
+                    yield note
+            yield from extra
+
+        self._titles, self._offsets, self._names = {}, {}, {}
+        self._version = ()  # until the save succeeds the index is incomplete
+        save_notes(notes(), self.path, on_write=self._record)
+        self._version = file_version(self.path)
+
+    def _new_notes(self, pairs):
+        for title, content in pairs:
+            yield {"id": self._next_id, "title": title, "content": content}
+            self._next_id += 1
+
+    def find(self, title):
+        self._refresh()
+        return list(self._titles.get(title_key(title), ()))
+
+    def add(self, title, content):
+        with locked(self.path):
+            self._refresh()
+            note_id = self._next_id
+            self._rewrite(extra=self._new_notes([(title, content)]))
+        return note_id
+
+    def add_many(self, notes):
+        with locked(self.path):
+            self._refresh()
+            before = len(self._offsets)
+            self._rewrite(extra=self._new_notes(notes))
+        return len(self._offsets) - before
+
+    def iter_notes(self):
+        notes = _cached_notes(self.path)
+        if notes is None:
+            return (note for _, note in self._iter_file())
+        return (note for _, note in self._numbered((None, dict(note)) for note in notes))
+
+    def iter_titles(self):
+        self._refresh()
+        return iter(list(self._names.items()))
+
+    def stored_bytes(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def get_by_id(self, note_id):
+        while True:
+            self._refresh()
+            if note_id not in self._offsets:
+                return None
+            try:
+                with open(self.path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    if (st.st_ino, st.st_size, st.st_mtime_ns) != self._version:
+                        continue  # replaced since the refresh
+                    f.seek(self._offsets[note_id])
+                    note = _ArrayReader(f, self.path).value()[1]
+            except FileNotFoundError:
+                continue
+            note.setdefault("id", note_id)
+            return note
+
+    def update_by_id(self, note_id, content, expected=None):
+        with locked(self.path):
+            note = self.get_by_id(note_id)
+            if note is None:
+                return False
+            if expected is not None and note["content"] != expected:
+                raise ConflictError(f"Note '{note['title']}' was changed by someone else")
+            self._rewrite(lambda note: dict(note, content=content) if note["id"] == note_id else note)
+        return True
+
+    def delete_by_id(self, note_id):
+        with locked(self.path):
+            self._refresh()
+            if note_id not in self._offsets:
+                return False
+            self._rewrite(lambda note: None if note["id"] == note_id else note)
+        return True
+
+
+class SqliteNoteStore(NoteStore):
+    """Notes in a SQLite database (WAL mode), one row per note keyed by id.
+
+    Titles are found through the title_key index, so every lookup reads
+    the database as it is now, whoever wrote it; every read, update or
+    delete is a primary-key lookup that writes only the row it changes.
+    Writes take SQLite's write lock up front, so concurrent processes queue
+    instead of overwriting each other.
+
+    Rows hold only a reference (blob) to their content, which lives
+    deduplicated and compressed in a BlobStore and is decompressed only
+    when a note is read.  Search goes through a FullTextIndex and updates
+    are kept in a RevisionLog.  All three live in the same database and
+    change in the same transaction as the note.  On first use an existing
+    JSON notes file is imported.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            content TEXT NOT NULL,
+            blob TEXT
+        );
+        CREATE INDEX IF NOT EXISTS notes_title_key ON notes (title_key);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path=NOTES_DB, migrate_from=NOTES_FILE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript(self.SCHEMA)
+            if "blob" not in {row["name"] for row in self.db.execute("PRAGMA table_info(notes)")}:
+                self.db.execute("ALTER TABLE notes ADD COLUMN blob TEXT")
+            self.blobs = BlobStore(self.db)
+            self.revisions = RevisionLog(self.db, self.blobs)
+            self.index = FullTextIndex(self.db)
+            if not self.db.execute("SELECT 1 FROM meta WHERE key = 'fts_docs'").fetchone():
+                # Databases created before the index existed, or before its current layout.
+                notes = map(self._note, self.db.execute(self.SELECT_NOTES).fetchall())
+                self.index.rebuild((note["id"], note["title"], note["content"]) for note in notes)
+        self._convert_to_blobs()
+        if migrate_from:
+            self._migrate(migrate_from)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A write transaction that holds the write lock from the start, so reads inside it are current."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.rollback()
+            raise
+        self.db.commit()
+
+    def _convert_to_blobs(self):
+        # Databases created before the blob store kept content inline.
+        with self._transaction():
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'blobs'").fetchone():
+                return
+            rows = self.db.execute("SELECT id, content FROM notes WHERE blob IS NULL").fetchall()
+            self.blobs.maybe_train([row["content"] for row in rows[:DICT_SAMPLES]])
+            for row in rows:
+                self.db.execute("UPDATE notes SET blob = ?, content = '' WHERE id = ?",
+                                (self.blobs.put(row["content"]), row["id"]))
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('blobs', '1')")
+
+    def _migrate(self, json_path):
+        # Only a new database imports the JSON file; the marker is written
+        # even when there is nothing to import, so a notes file that shows
+        # up later is not merged in.
+        source = os.path.abspath(json_path) if os.path.exists(json_path) else ""
+        with self._transaction():
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'migrated_from'").fetchone():
+                return
+            notes = ((note["title"], note["content"]) for _, note in iter_notes_file(json_path))
+            first = list(itertools.islice(notes, DICT_SAMPLES))
+            self.blobs.maybe_train([content for _, content in first])
+            for title, content in itertools.chain(first, notes):
+                self._insert(title, content)
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (source,))
+
+    # Note rows joined with their blob, so content is decoded without another query.
+    SELECT_NOTES = ("SELECT n.id, n.title, n.content, n.blob, b.codec, b.dict_id, b.data "
+                    "FROM notes n LEFT JOIN blobs b ON b.hash = n.blob")
+
+    def _note(self, row):
+        content = self.blobs.decode(row["codec"], row["dict_id"], row["data"]) if row["blob"] else row["content"]
+        return {"id": row["id"], "title": row["title"], "content": content}
+
+    def _insert(self, title, content, bump=True):
+        cur = self.db.execute("INSERT INTO notes (title, title_key, content, blob) VALUES (?, ?, '', ?)",
+                              (title, title_key(title), self.blobs.put(content)))
+        return cur.lastrowid, self.index.add(cur.lastrowid, title, content, bump)
+
+    def find(self, title):
+        return [row[0] for row in self.db.execute("SELECT id FROM notes WHERE title_key = ? ORDER BY id",
+                                                  (title_key(title),))]
+
+    def add(self, title, content):
+        with self._transaction():
+            note_id, _ = self._insert(title, content)
+            self.blobs.maybe_train()
+        return note_id
+
+    def add_many(self, notes):
+        """Insert in transactions of BULK_BATCH notes, consuming the iterable lazily."""
+        count = 0
+        notes = iter(notes)
+        while True:
+            batch = list(itertools.islice(notes, BULK_BATCH))
+            if not batch:
+                return count
+            tokens = 0
+            with self._transaction():
+                self.blobs.maybe_train([content for _, content in batch])
+                for title, content in batch:
+                    tokens += self._insert(title, content, bump=False)[1]
+                self.index._bump(len(batch), tokens)
+            count += len(batch)
+
+    def iter_notes(self):
+        for row in self.db.execute(self.SELECT_NOTES + " ORDER BY n.id"):
+            yield self._note(row)
+
+    def iter_titles(self):
+        for row in self.db.execute("SELECT id, title FROM notes ORDER BY id"):
+            yield row["id"], row["title"]
+
+    def get_by_id(self, note_id):
+        row = self.db.execute(self.SELECT_NOTES + " WHERE n.id = ?", (note_id,)).fetchone()
+        return self._note(row) if row else None
+
+    def update_by_id(self, note_id, content, expected=None):
+        with self._transaction():
+            row = self.db.execute("SELECT title, content, blob FROM notes WHERE id = ?", (note_id,)).fetchone()
+            if row is None:
+                return False
+            if expected is not None and row["blob"] != self.blobs.digest(expected):
+                raise ConflictError(f"Note '{row['title']}' was changed by someone else")
+            if row["blob"] == self.blobs.digest(content):
+                return True
+            self.revisions.record(note_id, self.blobs.get(row["blob"]), content)
+            self.db.execute("UPDATE notes SET blob = ?, content = '' WHERE id = ?",
+                            (self.blobs.put(content), note_id))
+            self.blobs.release(row["blob"])
+            self.index.remove(note_id)
+            self.index.add(note_id, row["title"], content)
+        return True
+
+    def delete_by_id(self, note_id):
+        with self._transaction():
+            row = self.db.execute("SELECT blob FROM notes WHERE id = ?", (note_id,)).fetchone()
+            if row is None:
+                return False
+            self.db.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+            self.blobs.release(row["blob"])
+            self.revisions.drop(note_id)
+            self.index.remove(note_id)
+        return True
+
+    def search(self, keyword, limit=20):
+        """Ranked full-text search; see FullTextIndex for the query syntax."""
+        results = []
+        for note_id, score, terms in self.index.search(keyword, limit):
+            note = self.get_by_id(note_id)
+            note["score"] = score
+            note["snippet"] = FullTextIndex.snippet(note["content"], terms)
+            results.append(note)
+        return results
+
+    def history(self, note_id):
+        return self.revisions.history(note_id)
+
+    def get_revision(self, note_id, rev):
+        return self.revisions.get(note_id, rev)
+
+    def stored_bytes(self):
+        blobs = self.db.execute("SELECT COALESCE(SUM(length(data)), 0) FROM blobs").fetchone()[0]
+        dicts = self.db.execute("SELECT COALESCE(SUM(length(data)), 0) FROM blob_dicts").fetchone()[0]
+        return blobs + dicts + self.revisions.stored_bytes()
+
+    def stats(self):
+        stats = super().stats()
+        stats["unique_contents"], stats["unique_bytes"] = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        stats["codec"] = self.blobs.codec + (" + dictionary" if self.blobs.dict_id else "")
+        return stats
+
+    def close(self):
+        self.db.close()
+
+
+_TOKEN_RE = re.compile(r"\w+")
+_QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class FullTextIndex:
+    """Persistent inverted index with BM25 ranking, kept in the notes database.
 
+    postings holds one row per (term, note) with the term frequency, token
+    positions and impact: the term's BM25 weight in that note, without the
+    idf, as of when the note was indexed.  terms keeps each term's document
+    frequency.  Title tokens come first in a note's token stream, followed
+    by the content after a gap so phrases never match across the two.
 
-def load_notes():
-    """Load notes from file."""
-    if not os.path.exists(NOTES_FILE):
-        return []
-    with open(NOTES_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    Queries are whitespace-separated clauses that must all match: a word, a
+    "quoted phrase" or a prefix*.  Results are ranked by BM25.  A search is
+    driven by its rarest clause, reading at most MAX_POSTINGS of its
+    postings best impact first, so for a word found nearly everywhere only
+    the notes where it weighs most are considered.  The other clauses are
+    looked up only for those candidates, and positions are loaded only to
+    check phrases on the best-scoring candidates until enough have matched.
+    """
 
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            note_id INTEGER NOT NULL,
+            tf INTEGER NOT NULL,
+            impact REAL NOT NULL,
+            positions TEXT NOT NULL,
+            PRIMARY KEY (term, note_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_note ON postings (note_id);
+        CREATE INDEX IF NOT EXISTS postings_impact ON postings (term, impact DESC);
+        CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS doc_lengths (note_id INTEGER PRIMARY KEY, length INTEGER NOT NULL);
+    """
+    K1 = 1.2
+    B = 0.75
+    TITLE_GAP = 1000
+    MAX_PREFIX_TERMS = 64
+    MAX_POSTINGS = 1000
+    # Note ids per IN (...) query, well under SQLite's limit on bound parameters.
+    CHUNK = 500
+    SNIPPET_CHARS = 60
 
-def save_notes(notes):
-    """Save notes to file."""
-    with open(NOTES_FILE, "w", encoding="utf-8") as f:
-        json.dump(notes, f, indent=2)
+    def __init__(self, db):
+        self.db = db
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(postings)")}
+        if columns and "impact" not in columns:
+            # Indexes built before postings had an impact are dropped; the store re-indexes its notes.
+            self.db.execute("DROP TABLE postings")
+            self.db.execute("DELETE FROM doc_lengths")
+            self.db.execute("DELETE FROM meta WHERE key IN ('fts_docs', 'fts_tokens')")
+        self.db.executescript(self.SCHEMA)
+        # Notes added with bump=False and not yet counted in the meta counters.
+        self._pending = (0, 0)
+
+    def _stats(self):
+        rows = dict(self.db.execute("SELECT key, value FROM meta WHERE key IN ('fts_docs', 'fts_tokens')"))
+        return int(rows.get("fts_docs", 0)), int(rows.get("fts_tokens", 0))
+
+    def _bump(self, docs, tokens):
+        n, total = self._stats()
+        self.db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                            (("fts_docs", str(n + docs)), ("fts_tokens", str(total + tokens))))
+        self._pending = (0, 0)
+
+    def add(self, note_id, title, content, bump=True):
+        """Index a note and return its length in tokens; call inside the transaction that writes it.
+
+        With bump=False the document counters are left for the caller to
+        update once per batch.
+        """
+        tokens = tokenize(title)
+        positions = {}
+        for pos, term in enumerate(tokens):
+            positions.setdefault(term, []).append(pos)
+        for pos, term in enumerate(tokenize(content), start=len(tokens) + self.TITLE_GAP):
+            positions.setdefault(term, []).append(pos)
+        length = sum(len(p) for p in positions.values())
+        n, total = self._stats()
+        n, total = n + self._pending[0], total + self._pending[1]
+        avg_len = total / n if n else max(length, 1)
+        norm = self.K1 * (1 - self.B + self.B * length / avg_len)
+        self.db.executemany(
+            "INSERT INTO postings (term, note_id, tf, impact, positions) VALUES (?, ?, ?, ?, ?)",
+            ((term, note_id, len(p), len(p) * (self.K1 + 1) / (len(p) + norm), " ".join(map(str, p)))
+             for term, p in positions.items()))
+        self.db.executemany("INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT (term) DO UPDATE SET df = df + 1",
+                            ((term,) for term in positions))
+        self.db.execute("INSERT INTO doc_lengths (note_id, length) VALUES (?, ?)", (note_id, length))
+        if bump:
+            self._bump(1, length)
+        else:
+            self._pending = (self._pending[0] + 1, self._pending[1] + length)
+        return length
+
+    def remove(self, note_id):
+        """Drop a note from the index; call inside the transaction that deletes or rewrites it."""
+        row = self.db.execute("SELECT length FROM doc_lengths WHERE note_id = ?", (note_id,)).fetchone()
+        if row is None:
+            return
+        note_terms = "SELECT term FROM postings WHERE note_id = ?"
+        self.db.execute(f"UPDATE terms SET df = df - 1 WHERE term IN ({note_terms})", (note_id,))
+        self.db.execute(f"DELETE FROM terms WHERE df <= 0 AND term IN ({note_terms})", (note_id,))
+        self.db.execute("DELETE FROM doc_lengths WHERE note_id = ?", (note_id,))
+        self.db.execute("DELETE FROM postings WHERE note_id = ?", (note_id,))
+        self._bump(-1, -row[0])
+
+    def rebuild(self, notes):
+        """Re-index from scratch from (id, title, content) rows."""
+        self.db.execute("DELETE FROM postings")
+        self.db.execute("DELETE FROM terms")
+        self.db.execute("DELETE FROM doc_lengths")
+        self.db.execute("DELETE FROM meta WHERE key IN ('fts_docs', 'fts_tokens')")
+        self._pending = (0, 0)
+        count = tokens = 0
+        for note_id, title, content in notes:
+            tokens += self.add(note_id, title, content, bump=False)
+            count += 1
+        self._bump(count, tokens)
+
+    def _df(self, terms):
+        """{term: number of notes containing it} for those of terms that are indexed."""
+        terms = list(terms)
+        df = {}
+        for i in range(0, len(terms), self.CHUNK):
+            chunk = terms[i:i + self.CHUNK]
+            df.update(self.db.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({','.join('?' * len(chunk))})", chunk))
+        return df
+
+    def _prefix_terms(self, prefix):
+        # Every term starting with prefix sorts between prefix and prefix + U+10FFFF.
+        rows = self.db.execute("SELECT term FROM terms WHERE term >= ? AND term < ? LIMIT ?",
+                               (prefix, prefix + "\U0010ffff", self.MAX_PREFIX_TERMS))
+        return [row[0] for row in rows]
+
+    def _parse(self, query):
+        """Split a query into clauses: ("terms", [alternatives]) or ("phrase", [words])."""
+        clauses = []
+        for phrase, word in _QUERY_RE.findall(query):
+            if word.endswith("*") and tokenize(word[:-1]):
+                clauses.append(("terms", self._prefix_terms(tokenize(word[:-1])[0])))
+                continue
+            words = tokenize(phrase or word)
+            if len(words) == 1:
+                clauses.append(("terms", words))
+            elif words:
+                clauses.append(("phrase", words))
+        return clauses
+
+    def _lookup(self, terms, note_ids):
+        """Yield (term, note_id, tf) for each of terms found in one of note_ids."""
+        terms = list(terms)
+        size = max(self.CHUNK - len(terms), 1)
+        for i in range(0, len(note_ids), size):
+            chunk = note_ids[i:i + size]
+            yield from self.db.execute(
+                f"SELECT term, note_id, tf FROM postings WHERE term IN ({','.join('?' * len(terms))}) "
+                f"AND note_id IN ({','.join('?' * len(chunk))})", terms + chunk)
+
+    def _has_phrases(self, note_id, phrases):
+        words = sorted({word for phrase in phrases for word in phrase})
+        positions = {term: {int(pos) for pos in text.split()} for term, text in self.db.execute(
+            f"SELECT term, positions FROM postings WHERE note_id = ? AND term IN ({','.join('?' * len(words))})",
+            [note_id] + words)}
+        for phrase in phrases:
+            starts = positions.get(phrase[0], set())
+            for offset, word in enumerate(phrase[1:], start=1):
+                starts = starts & {pos - offset for pos in positions.get(word, ())}
+            if not starts:
+                return False
+        return True
+
+    def search(self, query, limit=20):
+        """Return [(note_id, score, matched terms)] for the best-ranked notes matching every clause."""
+        clauses = self._parse(query)
+        if not clauses:
+            return []
+        df = self._df({term for _, words in clauses for term in words})
+        for kind, words in clauses:
+            if not (any if kind == "terms" else all)(word in df for word in words):
+                return []
+        # The clause matching the fewest notes gives the candidates: for a phrase its rarest word.
+        drivers = [[word for word in words if word in df] if kind == "terms" else [min(words, key=df.get)]
+                   for kind, words in clauses]
+        first = min(range(len(clauses)), key=lambda i: sum(df[word] for word in drivers[i]))
+        # MAX_POSTINGS are shared out rarest term first, so what a rare term leaves goes to the common ones.
+        budget = self.MAX_POSTINGS
+        terms = sorted(drivers[first], key=df.get)
+        matches = {}  # note_id -> {term: tf}
+        for i, term in enumerate(terms):
+            take = max(budget // (len(terms) - i), 1)
+            for note_id, tf in self.db.execute(
+                    "SELECT note_id, tf FROM postings WHERE term = ? ORDER BY impact DESC LIMIT ?", (term, take)):
+                matches.setdefault(note_id, {})[term] = tf
+            budget -= min(df[term], take)
+        for i, (kind, words) in enumerate(clauses):
+            # A prefix's other terms are looked up too, so its candidates are scored on all of them.
+            skip = drivers[first] if i == first and (kind == "phrase" or len(drivers[first]) == 1) else ()
+            words = [word for word in dict.fromkeys(words) if word in df and word not in skip]
+            if not words:
+                continue
+            found = {}
+            for term, note_id, tf in self._lookup(words, list(matches)):
+                found.setdefault(note_id, {})[term] = tf
+            if kind == "terms":
+                matches = {note_id: dict(tfs, **found[note_id]) for note_id, tfs in matches.items()
+                           if note_id in found}
+            else:
+                matches = {note_id: dict(tfs, **found[note_id]) for note_id, tfs in matches.items()
+                           if len(found.get(note_id, ())) == len(words)}
+            if not matches:
+                return []
+
+        n, total = self._stats()
+        avg_len = total / n if n else 1.0
+        idf = {term: math.log(1 + (n - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+        ids = list(matches)
+        lengths = {}
+        for i in range(0, len(ids), self.CHUNK):
+            chunk = ids[i:i + self.CHUNK]
+            lengths.update(self.db.execute(
+                f"SELECT note_id, length FROM doc_lengths WHERE note_id IN ({','.join('?' * len(chunk))})", chunk))
+        scored = []
+        for note_id, tfs in matches.items():
+            norm = self.K1 * (1 - self.B + self.B * lengths.get(note_id, avg_len) / avg_len)
+            score = sum(idf[term] * tf * (self.K1 + 1) / (tf + norm) for term, tf in tfs.items())
+            scored.append((note_id, score, sorted(tfs)))
+        phrases = [words for kind, words in clauses if kind == "phrase"]
+
+        def best(item):
+            # Highest score first, ties in note order.
+            return -item[1], item[0]
+
+        if not phrases:
+            if limit is None:
+                return sorted(scored, key=best)
+            return heapq.nsmallest(limit, scored, key=best)
+        # Positions are only read for candidates, best first, until enough of them hold every phrase.
+        results = []
+        for item in sorted(scored, key=best):
+            if self._has_phrases(item[0], phrases):
+                results.append(item)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+    @classmethod
+    def snippet(cls, text, terms):
+        """A window of text around the first matched term, with matches wrapped in [brackets]."""
+        pattern = re.compile(r"\b(" + "|".join(map(re.escape, sorted(terms, key=len, reverse=True))) + r")\b",
+                             re.IGNORECASE)
+        first = pattern.search(text)
+        if first is None:
+            return text[:cls.SNIPPET_CHARS * 2]
+        start = max(first.start() - cls.SNIPPET_CHARS, 0)
+        end = min(first.end() + cls.SNIPPET_CHARS, len(text))
+        window = pattern.sub(lambda m: f"[{m.group(0)}]", text[start:end])
+        return ("..." if start else "") + window + ("..." if end < len(text) else "")
+
+
+class BlobStore:
+    """Content-addressed, compressed note bodies kept in the notes database.
+
+    Each distinct content is stored once under its SHA-256 with a reference
+    count, compressed with zstd when the zstandard package is installed and
+    zlib otherwise.  Both use a shared dictionary trained from a sample of
+    notes, which is what lets short, similar notes (templates, pasted logs)
+    compress well.  Blobs record the dictionary they were written with, so
+    old ones stay readable whatever dictionary new ones use.  Another
+    process may train the dictionary after this one opened the database, so
+    dictionaries are loaded on first use rather than only at open.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            dict_id INTEGER,
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            refs INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS blob_dicts (id INTEGER PRIMARY KEY, codec TEXT NOT NULL, data BLOB NOT NULL);
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.db.executescript(self.SCHEMA)
+        self.codec = "zstd" if zstandard else "zlib"
+        self.dict_id = None  # dictionary new blobs are compressed with
+        self._dicts = {}
+        self._zstd = {}
+        self._trained = False
+        self._adopt_dict()
+
+    def _adopt_dict(self):
+        """Compress new blobs with the newest stored dictionary for this codec; False if there is none."""
+        row = self.db.execute("SELECT id, data FROM blob_dicts WHERE codec = ? ORDER BY id DESC LIMIT 1",
+                              (self.codec,)).fetchone()
+        if row is None:
+            return False
+        self.dict_id = row[0]
+        self._dicts[self.dict_id] = bytes(row[1])
+        return True
+
+    def _dict(self, dict_id):
+        if dict_id not in self._dicts:
+            row = self.db.execute("SELECT data FROM blob_dicts WHERE id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Missing compression dictionary {dict_id}")
+            self._dicts[dict_id] = bytes(row[0])
+        return self._dicts[dict_id]
+
+    @staticmethod
+    def digest(content):
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _zstd_codec(self, dict_id):
+        if zstandard is None:
+            raise ValueError("This notes database uses zstd; install the zstandard package to read it")
+        if dict_id not in self._zstd:
+            zdict = zstandard.ZstdCompressionDict(self._dict(dict_id)) if dict_id else None
+            self._zstd[dict_id] = (zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict),
+                                   zstandard.ZstdDecompressor(dict_data=zdict))
+        return self._zstd[dict_id]
+
+    def _compress(self, raw):
+        if self.codec == "zstd":
+            data = self._zstd_codec(self.dict_id)[0].compress(raw)
+        else:
+            c = zlib.compressobj(9, zdict=self._dict(self.dict_id)) if self.dict_id else zlib.compressobj(9)
+            data = c.compress(raw) + c.flush()
+        if len(data) >= len(raw):
+            return "raw", None, raw
+        return self.codec, self.dict_id, data
+
+    def _decompress(self, codec, dict_id, data):
+        if codec == "raw":
+            return data
+        if codec == "zstd":
+            return self._zstd_codec(dict_id)[1].decompress(data)
+        d = zlib.decompressobj(zdict=self._dict(dict_id)) if dict_id else zlib.decompressobj()
+        return d.decompress(data) + d.flush()
+
+    def put(self, content):
+        """Add a reference to content, storing it if it is new; return its hash."""
+        digest = self.digest(content)
+        if not self.db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (digest,)).rowcount:
+            raw = content.encode("utf-8")
+            codec, dict_id, data = self._compress(raw)
+            self.db.execute("INSERT INTO blobs (hash, codec, dict_id, size, data, refs) VALUES (?, ?, ?, ?, ?, 1)",
+                            (digest, codec, dict_id, len(raw), data))
+        return digest
+
+    def release(self, digest):
+        """Drop a reference, deleting the blob once nothing refers to it."""
+        self.db.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (digest,))
+        self.db.execute("DELETE FROM blobs WHERE hash = ? AND refs <= 0", (digest,))
+
+    def get(self, digest):
+        row = self.db.execute("SELECT codec, dict_id, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise ValueError(f"Missing note content {digest}")
+        return self.decode(*row)
+
+    def decode(self, codec, dict_id, data):
+        """Content from a blobs row's codec, dict_id and data columns."""
+        return self._decompress(codec, dict_id, bytes(data)).decode("utf-8")
+
+    @staticmethod
+    def _train_zlib(samples):
+        # zlib can only reach back DICT_SIZE bytes and matches the end of the
+        # dictionary most cheaply, so repeated lines go last, most common at the end.
+        counts = collections.Counter(line for text in samples for line in set(text.splitlines(keepends=True)))
+        picked, size = [], 0
+        for line, count in counts.most_common():
+            data = line.encode("utf-8")
+            if count < 2 or size + len(data) > DICT_SIZE:
+                break
+            picked.append(data)
+            size += len(data)
+        filler = "".join(samples).encode("utf-8")[:DICT_SIZE - size]
+        return filler + b"".join(reversed(picked))
+
+    def maybe_train(self, samples=None):
+        """Train the shared dictionary once, from samples or the stored blobs, if there are enough.
+
+        Call inside a write transaction: a dictionary another process trained
+        meanwhile is picked up instead of training a second one.
+        """
+        if self.dict_id is not None or self._trained or self._adopt_dict():
+            return
+        if samples is None:
+            rows = self.db.execute("SELECT hash FROM blobs LIMIT ?", (DICT_SAMPLES,)).fetchall()
+            if len(rows) < DICT_MIN_SAMPLES:
+                return
+            samples = [self.get(row[0]) for row in rows]
+        if len(samples) < DICT_MIN_SAMPLES:
+            return
+        self._trained = True
+        samples = samples[:DICT_SAMPLES]
+        if self.codec == "zstd":
+            try:
+                data = zstandard.train_dictionary(DICT_SIZE, [s.encode("utf-8") for s in samples]).as_bytes()
+            except zstandard.ZstdError:
+                return  # too little sample data to train on
+        else:
+            data = self._train_zlib(samples)
+        cur = self.db.execute("INSERT INTO blob_dicts (codec, data) VALUES (?, ?)", (self.codec, data))
+        self.dict_id = cur.lastrowid
+        self._dicts[self.dict_id] = data
+
+
+def make_delta(old, new):
+    """Line-level delta from old to new: [start, end] copies old lines, a string inserts text."""
+    a, b = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append("".join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old, ops):
+    lines = old.splitlines(keepends=True)
+    return "".join(op if isinstance(op, str) else "".join(lines[op[0]:op[1]]) for op in ops)
+
+
+class RevisionLog:
+    """Per-note revision history kept in the notes database.
+
+    History starts on a note's first update: revision 1 is the content it
+    had before.  Every SNAPSHOT_EVERY-th revision is a full snapshot stored
+    through the BlobStore; the ones in between are compressed line deltas
+    against the revision before, so rebuilding any revision reads one
+    snapshot and at most SNAPSHOT_EVERY - 1 deltas.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS revisions (
+            note_id INTEGER NOT NULL,
+            rev INTEGER NOT NULL,
+            created REAL,
+            size INTEGER NOT NULL,
+            blob TEXT,
+            delta BLOB,
+            PRIMARY KEY (note_id, rev)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db, blobs):
+        self.db = db
+        self.blobs = blobs
+        self.db.executescript(self.SCHEMA)
+
+    def _store(self, note_id, rev, created, base, content):
+        blob = delta = None
+        if base is None or rev % SNAPSHOT_EVERY == 1:
+            blob = self.blobs.put(content)
+        else:
+            delta = zlib.compress(json.dumps(make_delta(base, content), separators=(",", ":")).encode("utf-8"))
+        self.db.execute("INSERT INTO revisions (note_id, rev, created, size, blob, delta) VALUES (?, ?, ?, ?, ?, ?)",
+                        (note_id, rev, created, len(content.encode("utf-8")), blob, delta))
+
+    def record(self, note_id, previous, content):
+        """Log content as a note's newest revision, replacing previous; call inside the transaction that writes it."""
+        row = self.db.execute("SELECT MAX(rev) FROM revisions WHERE note_id = ?", (note_id,)).fetchone()
+        rev = row[0]
+        if rev is None:
+            # When the note was first written is not known.
+            self._store(note_id, 1, None, None, previous)
+            rev = 1
+        self._store(note_id, rev + 1, time.time(), previous, content)
+
+    def history(self, note_id):
+        """[(rev, created or None, size in bytes)], oldest first."""
+        return [tuple(row) for row in self.db.execute(
+            "SELECT rev, created, size FROM revisions WHERE note_id = ? ORDER BY rev", (note_id,))]
+
+    def get(self, note_id, rev):
+        """The content of a revision, or None if there is no such revision."""
+        start = rev - (rev - 1) % SNAPSHOT_EVERY
+        rows = self.db.execute("SELECT rev, blob, delta FROM revisions WHERE note_id = ? AND rev BETWEEN ? AND ? "
+                               "ORDER BY rev", (note_id, start, rev)).fetchall()
+        if not rows or rows[-1]["rev"] != rev:
+            return None
+        content = self.blobs.get(rows[0]["blob"])
+        for row in rows[1:]:
+            content = apply_delta(content, json.loads(zlib.decompress(row["delta"])))
+        return content
+
+    def drop(self, note_id):
+        for row in self.db.execute("SELECT blob FROM revisions WHERE note_id = ? AND blob IS NOT NULL", (note_id,)):
+            self.blobs.release(row["blob"])
+        self.db.execute("DELETE FROM revisions WHERE note_id = ?", (note_id,))
+
+    def stored_bytes(self):
+        return self.db.execute("SELECT COALESCE(SUM(length(delta)), 0) FROM revisions").fetchone()[0]
+
+
+STORES = {"json": JsonNoteStore, "sqlite": SqliteNoteStore}
+_store = None
+
+
+def open_store(storage=None, **options):
+    storage = storage or NOTES_STORAGE
+    if storage not in STORES:
+        raise ValueError(f"Unknown storage '{storage}' (choose from {', '.join(STORES)})")
+    return STORES[storage](**options)
+
+
+def get_store():
+    """The store the menu works on, opened on first use according to NOTES_STORAGE."""
+    global _store
+    if _store is None:
+        try:
+            _store = open_store()
+        except ValueError as e:
+            raise SystemExit(str(e))
+    return _store
+
+
+EXPORT_FIELDS = ("id", "title", "content")
+
+
+def _file_format(path, fmt):
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def _open_text(path, mode):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _record(record, where):
+    if not isinstance(record, dict) or not isinstance(record.get("title"), str):
+        raise ValueError(f"{where}: expected an object with a string 'title'")
+    content = record.get("content") or ""
+    if not isinstance(content, str):
+        raise ValueError(f"{where}: 'content' must be a string")
+    return record["title"], content
+
+
+def read_notes_file(path, fmt=None):
+    """Yield (title, content) pairs from an NDJSON or CSV file, one record at a time."""
+    with _open_text(path, "r") as f:
+        if _file_format(path, fmt) == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield _record(row, f"{path}:{reader.line_num}")
+            return
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_no}: invalid JSON ({e.msg})")
+            yield _record(record, f"{path}:{line_no}")
+
+
+def write_notes_file(notes, path, fmt=None):
+    """Write notes as NDJSON or CSV as they are produced; return how many were written."""
+    count = 0
+    with _open_text(path, "w") as f:
+        if _file_format(path, fmt) == "csv":
+            writer = csv.DictWriter(f, EXPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for note in notes:
+                writer.writerow(note)
+                count += 1
+            return count
+        for note in notes:
+            f.write(json.dumps({field: note[field] for field in EXPORT_FIELDS}, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+class Notes:
+    """Scripting API over a note store, used by the command line.
+
+        with Notes("sqlite") as notes:
+            notes.add("Groceries", "milk, eggs")
+            notes.import_file("dump.ndjson")
+    """
+
+    def __init__(self, storage=None, **options):
+        self.store = open_store(storage, **options)
+
+    def add(self, title, content):
+        return self.store.add(title, content)
+
+    def get(self, title):
+        """Every note with this title, oldest first."""
+        return [self.store.get_by_id(note_id) for note_id in self.store.find(title)]
+
+    def search(self, query, limit=20):
+        return self.store.search(query, limit)
+
+    def delete(self, title):
+        return self.store.delete(title)
+
+    def import_file(self, path, fmt=None):
+        """Bulk-add notes from NDJSON or CSV ("-" for stdin); return how many were added."""
+        return self.store.add_many(read_notes_file(path, fmt))
+
+    def export_file(self, path, fmt=None):
+        """Write every note as NDJSON or CSV ("-" for stdout); return how many were written."""
+        return write_notes_file(self.store.iter_notes(), path, fmt)
+
+    def close(self):
+        self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def choose_notes(title, allow_all=False):
+    """Resolve a title to note ids, asking which one is meant when several share it."""
+    store = get_store()
+    ids = store.find(title)
+    if len(ids) <= 1:
+        return ids
+    print(f"{len(ids)} notes are titled '{title}':")
+    for i, note_id in enumerate(ids, start=1):
+        content = store.get_by_id(note_id)["content"]
+        print(f"{i}. {content[:50]}{'...' if len(content) > 50 else ''}")
+    prompt = f"Choose a note (1-{len(ids)}{', or a for all' if allow_all else ''}): "
+    choice = input(prompt).strip().lower()
+    if allow_all and choice == "a":
+        return ids
+    if choice.isdigit() and 1 <= int(choice) <= len(ids):
+        return [ids[int(choice) - 1]]
+    print("Invalid choice.")
+    return []
 
 
 def add_note():
     title = input("Enter note title: ").strip()
     content = input("Enter note content: ").strip()
-    notes = load_notes()
-    notes.append({"title": title, "content": content})
-    save_notes(notes)
+    get_store().add(title, content)
     print(f" Note '{title}' added successfully!")
 
 
 def view_notes():
-    notes = load_notes()
-    if not notes:
+    found = False
+    for i, (_, title) in enumerate(get_store().iter_titles(), start=1):
+        if not found:
+            print("\n📝 All Notes:")
+            found = True
+        print(f"{i}. {title}")
+    if not found:
         print("No notes found.")
         return
-    print("\n📝 All Notes:")
-    for i, note in enumerate(notes, start=1):
-        print(f"{i}. {note['title']}")
     print()
 
 
 def read_note():
-    notes = load_notes()
-    if not notes:
-        print("No notes to read.")
-        return
     title = input("Enter the note title to read: ").strip()
-    for note in notes:
-        if note["title"].lower() == title.lower():
-            print(f"\nTitle: {note['title']}")
-            print(f"Content:\n{note['content']}\n")
-            return
-    print(" Note not found.")
+    if not get_store().find(title):
+        print(" Note not found.")
+        return
+    for note_id in choose_notes(title):
+        note = get_store().get_by_id(note_id)
+        print(f"\nTitle: {note['title']}")
+        print(f"Content:\n{note['content']}\n")
 
 
 def search_notes():
-    keyword = input("Enter keyword to search: ").lower()
-    notes = load_notes()
-    found = [note for note in notes if keyword in note["title"].lower() or keyword in note["content"].lower()]
+    keyword = input("Enter keyword to search (\"phrase\", prefix*): ").lower()
+    found = get_store().search(keyword)
     if not found:
         print("No matching notes found.")
         return
     print("\n🔍 Search Results:")
     for note in found:
         print(f"- {note['title']}")
+        if note.get("snippet"):
+            print(f"    {note['snippet']}")
     print()
 
 
 def delete_note():
-    notes = load_notes()
-    if not notes:
-        print("No notes to delete.")
-        return
     title = input("Enter the title of the note to delete: ").strip()
-    new_notes = [note for note in notes if note["title"].lower() != title.lower()]
-    if len(new_notes) == len(notes):
+    if not get_store().find(title):
         print(" Note not found.")
         return
-    save_notes(new_notes)
-    print(f"🗑️ Note '{title}' deleted successfully!")
+    deleted = sum(get_store().delete_by_id(note_id) for note_id in choose_notes(title, allow_all=True))
+    if deleted:
+        print(f"🗑️ Note '{title}' deleted successfully!")
 
 
 def update_note():
-    notes = load_notes()
-    if not notes:
-        print("No notes to update.")
-        return
     title = input("Enter the title of the note to update: ").strip()
-    for note in notes:
-        if note["title"].lower() == title.lower():
-            print(f"Current content:\n{note['content']}")
-            new_content = input("Enter new content: ").strip()
-            note["content"] = new_content
-            save_notes(notes)
-            print(f"✅ Note '{title}' updated successfully!")
+    if not get_store().find(title):
+        print(" Note not found.")
+        return
+    for note_id in choose_notes(title):
+        note = get_store().get_by_id(note_id)
+        if note is None:
+            print(" Note not found.")
             return
-    print(" Note not found.")
+        current = note["content"]
+        print(f"Current content:\n{current}")
+        new_content = input("Enter new content: ").strip()
+        try:
+            get_store().update_by_id(note_id, new_content, expected=current)
+        except ConflictError:
+            print(" Note was changed elsewhere while you were editing; nothing saved. Try again.")
+            return
+        print(f"✅ Note '{title}' updated successfully!")
+
+
+def _print_history(history):
+    for rev, created, size in history:
+        when = datetime.datetime.fromtimestamp(created).strftime("%Y-%m-%d %H:%M:%S") if created else "original"
+        print(f"  r{rev:<5} {when:<19}  {size} bytes")
+
+
+def note_history():
+    title = input("Enter the title of the note: ").strip()
+    if not get_store().find(title):
+        print(" Note not found.")
+        return
+    for note_id in choose_notes(title):
+        try:
+            history = get_store().history(note_id)
+        except ValueError as e:
+            print(f" {e}")
+            return
+        if not history:
+            print("This note has not been changed since it was added.")
+            return
+        print(f"\n🕘 History of '{title}':")
+        _print_history(history)
+        rev = input("Revision to restore (press Enter to keep the current one): ").strip().lstrip("r")
+        if not rev:
+            return
+        if not rev.isdigit() or not get_store().restore(note_id, int(rev)):
+            print(" No such revision.")
+            return
+        print(f"✅ Note '{title}' restored to revision {rev}!")
 
 
 def main_menu():
@@ -105,8 +1457,9 @@ def main_menu():
         print("4. Search Notes")
         print("5. Update Note")
         print("6. Delete Note")
-        print("7. Exit")
-        choice = input("Enter choice (1-7): ").strip()
+        print("7. Note History")
+        print("8. Exit")
+        choice = input("Enter choice (1-8): ").strip()
 
         if choice == "1":
             add_note()
@@ -121,11 +1474,109 @@ def main_menu():
         elif choice == "6":
             delete_note()
         elif choice == "7":
+            note_history()
+        elif choice == "8":
             print("👋 Goodbye!")
             break
         else:
             print("Invalid choice, try again!")
 
 
+def _report(verb, count, started):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"{verb} {count} notes in {elapsed:.2f} s ({rate:,.0f} notes/s)", file=sys.stderr)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        main_menu()
+        return
+    p = argparse.ArgumentParser(description="Notes Keeper (run without arguments for the interactive menu)")
+    p.add_argument("--storage", default=NOTES_STORAGE, help=f"{' or '.join(STORES)} (default: {NOTES_STORAGE})")
+    sub = p.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="add a note")
+    add.add_argument("title")
+    add.add_argument("content", help='note text, or "-" to read it from stdin')
+    sub.add_parser("get", help="print the notes with a title").add_argument("title")
+    search = sub.add_parser("search", help='ranked search ("phrase", prefix*)')
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=20)
+    sub.add_parser("delete", help="delete every note with a title").add_argument("title")
+    sub.add_parser("stats", help="storage size, compression ratio and load time")
+    history = sub.add_parser("history", help="list the revisions of a note")
+    restore = sub.add_parser("restore", help="bring back an earlier revision of a note")
+    for cmd in (history, restore):
+        cmd.add_argument("title")
+        cmd.add_argument("--id", type=int, help="which note, when several share the title")
+    restore.add_argument("rev", type=int, help="revision number from history")
+    for name, helptext in (("import", "add notes from an NDJSON or CSV file"),
+                           ("export", "write all notes to an NDJSON or CSV file")):
+        cmd = sub.add_parser(name, help=helptext)
+        cmd.add_argument("path", help='file path, or "-" for stdin/stdout')
+        cmd.add_argument("--format", choices=("ndjson", "csv"), help="default: from the file extension")
+    args = p.parse_args(argv)
+
+    try:
+        with Notes(args.storage) as notes:
+            if args.command == "add":
+                content = sys.stdin.read().strip() if args.content == "-" else args.content
+                notes.add(args.title, content)
+                print(f" Note '{args.title}' added successfully!")
+            elif args.command == "get":
+                found = notes.get(args.title)
+                if not found:
+                    print(" Note not found.", file=sys.stderr)
+                    return 1
+                for note in found:
+                    print(f"Title: {note['title']}\nContent:\n{note['content']}\n")
+            elif args.command == "search":
+                for note in notes.search(args.query, args.limit):
+                    print(f"- {note['title']}")
+                    if note.get("snippet"):
+                        print(f"    {note['snippet']}")
+            elif args.command == "delete":
+                if not notes.delete(args.title):
+                    print(" Note not found.", file=sys.stderr)
+                    return 1
+                print(f"🗑️ Note '{args.title}' deleted successfully!")
+            elif args.command in ("history", "restore"):
+                ids = notes.store.find(args.title)
+                if args.id is not None:
+                    ids = [note_id for note_id in ids if note_id == args.id]
+                if not ids:
+                    print(" Note not found.", file=sys.stderr)
+                    return 1
+                if len(ids) > 1:
+                    raise ValueError(f"{len(ids)} notes are titled '{args.title}'; pick one with --id "
+                                     f"({', '.join(map(str, ids))})")
+                if args.command == "history":
+                    _print_history(notes.store.history(ids[0]))
+                elif not notes.store.restore(ids[0], args.rev):
+                    raise ValueError(f"Note '{args.title}' has no revision {args.rev}")
+                else:
+                    print(f"✅ Note '{args.title}' restored to revision {args.rev}!")
+            elif args.command == "stats":
+                stats = notes.store.stats()
+                print(f"Notes:          {stats['notes']}")
+                print(f"Content:        {stats['content_bytes']:,} bytes")
+                if "unique_contents" in stats:
+                    print(f"Unique:         {stats['unique_contents']} contents, {stats['unique_bytes']:,} bytes")
+                    print(f"Codec:          {stats['codec']}")
+                print(f"Stored:         {stats['stored_bytes']:,} bytes (ratio {stats['ratio']:.2f}x)")
+                print(f"Load all notes: {stats['load_seconds'] * 1000:.1f} ms")
+            elif args.command == "import":
+                started = time.perf_counter()
+                _report("Imported", notes.import_file(args.path, args.format), started)
+            elif args.command == "export":
+                started = time.perf_counter()
+                _report("Exported", notes.export_file(args.path, args.format), started)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
 if __name__ == "__main__":
-    main_menu()
+    sys.exit(main())